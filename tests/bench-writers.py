@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the file writing Consumers on a bundle with many keys, comparing
+the streaming writers with serializing the whole document into one string.
+
+    python3 tests/bench-writers.py [number-of-keys]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vaultify import consumers, util  # noqa: E402
+
+
+def in_memory(writer, data):
+    """
+    The former way: build the complete document, then write it.
+    """
+    if isinstance(writer, consumers.DotEnvWriter):
+        document = "\n".join(util.dict2env(data))
+    elif isinstance(writer, consumers.JsonWriter):
+        document = json.dumps(data, sort_keys=True, indent=2)
+    else:
+        document = yaml.dump(
+            data, default_flow_style=False, allow_unicode=True, encoding="utf-8"
+        ).decode()
+    writer.write(document)
+
+
+def measure(func, writer, data):
+    """
+    Return the seconds and the peak of traced memory it takes to write data.
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    func(writer, data)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(keys=100000):
+    data = {
+        "KEY_{:06d}".format(index): "value-{}-it's".format(index)
+        for index in range(keys)
+    }
+    print("{} keys, yaml dumper {}".format(keys, consumers.YAML_DUMPER.__name__))
+    print("{:<14} {:<10} {:>9} {:>14}".format("writer", "mode", "time", "peak memory"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for writer_class in (
+            consumers.DotEnvWriter,
+            consumers.JsonWriter,
+            consumers.YamlWriter,
+        ):
+            writer = writer_class(
+                os.path.join(tmp, writer_class.__name__), overwrite=True
+            )
+            for mode, func in (
+                ("string", in_memory),
+                ("streaming", writer_class.consume_secrets),
+            ):
+                seconds, peak = measure(func, writer, data)
+                print(
+                    "{:<14} {:<10} {:>8.3f}s {:>10.1f} KiB".format(
+                        writer_class.__name__, mode, seconds, peak / 1024
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,6 @@
+#!/bin/sh
+# appends $K1 to the file $1 and crashes on its first run
+echo "$K1" >> "$1"
+test -e "$1.crashed" && exit 0
+touch "$1.crashed"
+exit 1
@@ -0,0 +1,3 @@
+#!/bin/sh
+printf "K9=%s\n" "$K9"
+cat "/proc/self/fd/$VAULTIFY_MEMFD"
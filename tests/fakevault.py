@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A minimal fake of the vault HTTP API for the doctests. It serves the secrets
+it was given on a local port and records every request.
+"""
+
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+def fake_encrypt(plaintext: str) -> str:
+    """
+    Return a fake transit ciphertext, that `fake_decrypt` understands.
+
+    >>> fake_encrypt("V1")
+    'vault:v1:VjE='
+    """
+    return "vault:v1:" + base64.b64encode(plaintext.encode()).decode()
+
+
+def fake_decrypt(method: str, body: dict) -> tuple:
+    """
+    A handler for `transit/decrypt/<key>`, that decrypts fake ciphertexts.
+
+    >>> fake_decrypt("POST", {"batch_input": [{"ciphertext": "vault:v1:VjE="}]})
+    (200, {'data': {'batch_results': [{'plaintext': 'VjE='}]}})
+    """
+    results = []
+    for item in body["batch_input"]:
+        if item["ciphertext"].startswith("vault:v1:"):
+            results.append({"plaintext": item["ciphertext"][len("vault:v1:") :]})
+        else:
+            results.append({"error": "invalid ciphertext"})
+    return 200, {"data": {"batch_results": results}}
+
+
+class FakeVault:
+    """
+    >>> import hvac
+    >>> vault = FakeVault({"secret/app": {"K1": "V1"}}).start()
+    >>> hvac.Client(url=vault.addr, token="t").read("secret/app")["data"]
+    {'K1': 'V1'}
+    >>> vault.requests
+    [('GET', '/v1/secret/app')]
+    >>> vault.stop()
+    """
+
+    def __init__(self, secrets: dict = None, delay: float = 0.0, sealed: bool = False):
+        self.secrets = secrets or {}
+        self.delay = delay
+        self.sealed = sealed
+        self.requests = []
+        self.handlers = {}
+        self._server = None
+
+    @property
+    def addr(self) -> str:
+        return "http://127.0.0.1:{}".format(self._server.server_address[1])
+
+    def handle(self, method: str, path: str, body: dict) -> tuple:
+        """
+        Return (status, json body) for a request.
+        """
+        time.sleep(self.delay)
+        route = urlsplit(path).path[len("/v1/") :]
+
+        if route == "sys/health":
+            return (503 if self.sealed else 200), {"sealed": self.sealed}
+        if self.sealed:
+            return 503, {"errors": ["Vault is sealed"]}
+        if route in self.handlers:
+            return self.handlers[route](method, body)
+        if route in self.secrets:
+            return 200, {"data": self.secrets[route]}
+        return 404, {"errors": []}
+
+    def start(self) -> "FakeVault":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if urlsplit(self.path).path != "/v1/sys/health":
+                    fake.requests.append((self.command, self.path))
+                status, payload = fake.handle(self.command, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_LIST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
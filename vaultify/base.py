@@ -6,21 +6,46 @@ This file implements the vaultify base class.
 import abc
 import typing as t
 import logging
+from .selection import Selection
 
 
 logger = logging.getLogger(__name__)
 
 
 class Provider:
+    selection = Selection()
+
     def __str__(self):
         return "{}".format(self.__class__)
 
+    def push_down(self, selection: Selection):
+        """
+        Let the Provider skip sources and keys, that are not selected.
+        """
+        self.selection = selection
+
+    def sources(self) -> t.Iterable:
+        raise NotImplementedError
+
+    def get_source(self, source: str) -> dict:
+        raise NotImplementedError
+
+    def changed(self) -> bool:
+        """
+        Tell cheaply, whether the secrets changed since the last
+        `get_secrets`. Providers, that can not tell, never report a change.
+        """
+        return False
+
     @abc.abstractmethod
     def get_secrets(self) -> dict:
         pass
 
 
 class Consumer(metaclass=abc.ABCMeta):
+    # set by Vaultify: returns fresh secrets, or None if they did not change
+    refresh = None
+
     def __str__(self):
         return "{}".format(self.__class__)
 
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements running many provider/consumer jobs in one process.
+"""
+
+import json
+import logging
+import threading
+import time
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import yaml
+
+from .base import Provider
+from .selection import Selection
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("Batch", "SharedProvider", "run_batch")
+
+
+class SharedProvider(Provider):
+    """
+    This Provider hands out the result of one wrapped Provider to any number
+    of jobs. The wrapped Provider runs once, no matter how many jobs ask for
+    its secrets concurrently.
+
+    >>> from .providers import PlainTextProvider
+    >>> shared = SharedProvider(PlainTextProvider())
+    >>> shared.get_secrets() is shared.get_secrets()
+    True
+    """
+
+    def __init__(self, provider: Provider):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._result = None
+
+    def __str__(self):
+        return "{}({})".format(self.__class__, self.provider)
+
+    def get_secrets(self) -> dict:
+        with self._lock:
+            owner = self._result is None
+            if owner:
+                self._result = Future()
+
+        if owner:
+            try:
+                self._result.set_result(self.provider.get_secrets())
+            except Exception as error:
+                self._result.set_exception(error)
+        return self._result.result()
+
+
+class Batch:
+    """
+    Run the jobs of a manifest concurrently. Jobs whose providers have the
+    same class, args and selection share one provider and with that one fetch.
+
+    >>> batch = Batch({
+    ...     "jobs": {
+    ...         "json": {
+    ...             "provider": {"class": "PlainTextProvider", "args": {}},
+    ...             "consumer": {"class": "JsonWriter",
+    ...                          "args": {"path": "tests/new.batch.json", "overwrite": True}},
+    ...         },
+    ...         "yaml": {
+    ...             "provider": {"class": "PlainTextProvider"},
+    ...             "consumer": {"class": "YamlWriter",
+    ...                          "args": {"path": "tests/new.batch.yaml", "overwrite": True}},
+    ...         },
+    ...         "broken": {
+    ...             "provider": {"class": "NoSuchProvider"},
+    ...             "consumer": {"class": "JsonWriter", "args": {"path": "tests/new.batch"}},
+    ...         },
+    ...     }
+    ... })
+    >>> len(batch.providers)
+    1
+    >>> results = batch.run()
+    >>> [(name, status) for name, status, _ in results]
+    [('json', 'ok'), ('yaml', 'ok'), ('broken', 'failed')]
+    >>> print(batch.broken[batch._provider_key({"class": "NoSuchProvider"})])
+    module 'vaultify.providers' has no attribute 'NoSuchProvider'
+    >>> open('tests/new.batch.yaml').read()
+    'K1: V1\\nK2: V2\\n\\n'
+    """
+
+    def __init__(self, manifest: dict, workers: int = None):
+        from . import providers
+
+        self.workers = workers or manifest.get("workers", 4)
+        self.jobs = manifest["jobs"]
+        self.providers = {}
+        # the construction errors of providers, reported by each of their jobs
+        self.broken = {}
+
+        for name, job in self.jobs.items():
+            key = self._provider_key(job["provider"])
+            if key in self.providers:
+                continue
+            try:
+                provider_class = getattr(providers, job["provider"]["class"])
+                provider = provider_class(**job["provider"].get("args", {}))
+                provider.push_down(Selection(job["provider"].get("select")))
+                self.providers[key] = SharedProvider(provider)
+            except Exception as error:
+                logger.critical("job {} has a broken provider: {}".format(name, error))
+                self.broken[key] = error
+
+    @staticmethod
+    def _provider_key(provider_cfg: dict) -> tuple:
+        return (
+            provider_cfg["class"],
+            json.dumps(provider_cfg.get("args", {}), sort_keys=True),
+            json.dumps(provider_cfg.get("select", {}), sort_keys=True),
+        )
+
+    def _run_job(self, name: str, job: dict) -> t.Tuple[str, str, float]:
+        from . import consumers
+        from .vaultify import Vaultify
+
+        started = time.monotonic()
+        try:
+            key = self._provider_key(job["provider"])
+            if key in self.broken:
+                raise self.broken[key]
+            provider = self.providers[key]
+            consumer_class = getattr(consumers, job["consumer"]["class"])
+            vaultify = Vaultify(
+                provider=provider,
+                consumer=consumer_class(**job["consumer"].get("args", {})),
+            )
+            vaultify.run()
+            status = "ok"
+        except Exception as error:
+            logger.critical("job {} failed: {}".format(name, error))
+            status = "failed"
+
+        return name, status, time.monotonic() - started
+
+    def run(self) -> t.List[t.Tuple[str, str, float]]:
+        """
+        Run all jobs and return (name, status, seconds) in manifest order.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [
+                pool.submit(self._run_job, name, job) for name, job in self.jobs.items()
+            ]
+            return [future.result() for future in futures]
+
+
+def format_results(results: t.Iterable) -> str:
+    """
+    >>> print(format_results([("app", "ok", 0.25), ("db", "failed", 1.5)]))
+    job  status  seconds
+    app  ok        0.250
+    db   failed    1.500
+    """
+    results = list(results)
+    width = max([len("job")] + [len(name) for name, _, _ in results])
+    lines = ["{:<{w}}  {:<6}  {:>7}".format("job", "status", "seconds", w=width)]
+    for name, status, seconds in results:
+        lines.append("{:<{w}}  {:<6}  {:>7.3f}".format(name, status, seconds, w=width))
+    return "\n".join(lines)
+
+
+def run_batch(manifest_file: str, workers: int = None) -> bool:
+    """
+    Load a manifest, run its jobs and print a status table. Returns True,
+    when all jobs succeeded.
+    """
+    with open(manifest_file) as infile:
+        manifest = yaml.safe_load(infile)
+
+    results = Batch(manifest, workers=workers).run()
+    print(format_results(results))
+    return all(status == "ok" for _, status, _ in results)
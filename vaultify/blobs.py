@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements binary secrets, which are streamed to their destination
+instead of being held in memory as strings.
+"""
+
+import abc
+import base64
+import logging
+import os
+import shutil
+import tempfile
+import typing as t
+from subprocess import Popen, PIPE  # nosec
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("Blob", "FileBlob", "ProcessBlob", "Base64Blob")
+
+CHUNK_SIZE = 1 << 16
+
+
+class Blob(metaclass=abc.ABCMeta):
+    """
+    A binary secret. Its content is only produced while writing it to a
+    binary file object, chunk by chunk.
+    """
+
+    def __repr__(self):
+        return "<{}>".format(self.__class__.__name__)
+
+    @abc.abstractmethod
+    def write_to(self, out: t.BinaryIO) -> int:
+        """
+        Stream the content into `out` and return the number of bytes written.
+        """
+        pass
+
+
+class FileBlob(Blob):
+    """
+    A binary secret stored in a plain file.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> FileBlob('tests/secrets.env').write_to(out) == os.path.getsize('tests/secrets.env')
+    True
+    """
+
+    def __init__(self, filename: str, chunk_size: int = CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+
+    def write_to(self, out: t.BinaryIO) -> int:
+        with open(self.filename, "rb") as infile:
+            shutil.copyfileobj(infile, out, self.chunk_size)
+        return os.path.getsize(self.filename)
+
+
+class ProcessBlob(Blob):
+    """
+    A binary secret produced on stdout by a process, e.g. by decrypting a file.
+    The output is copied to the destination while the process still runs.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> ProcessBlob(['printf', 'a\\\\000b']).write_to(out)
+    3
+    >>> out.getvalue()
+    b'a\\x00b'
+    >>> ProcessBlob(['false']).write_to(out)
+    Traceback (most recent call last):
+    ...
+    ChildProcessError: terminated with an non-zero value: b''
+    """
+
+    def __init__(self, cmd: list, executable: str = None, chunk_size: int = CHUNK_SIZE):
+        self.cmd = cmd
+        self.executable = executable
+        self.chunk_size = chunk_size
+
+    def write_to(self, out: t.BinaryIO) -> int:
+        written = 0
+        with tempfile.TemporaryFile() as errors:
+            proc = Popen(  # nosec
+                self.cmd,
+                executable=self.executable,
+                stdout=PIPE,
+                stderr=errors,
+                bufsize=0,
+            )
+            with proc.stdout:
+                for chunk in iter(lambda: proc.stdout.read(self.chunk_size), b""):
+                    out.write(chunk)
+                    written += len(chunk)
+            if proc.wait():
+                errors.seek(0)
+                raise ChildProcessError(
+                    "terminated with an non-zero value: {}".format(errors.read())
+                )
+        return written
+
+
+class Base64Blob(Blob):
+    """
+    A binary secret transported as base64 text, e.g. a vault value. It is
+    decoded chunk by chunk, so that no second full copy is made.
+
+    >>> import io
+    >>> out = io.BytesIO()
+    >>> Base64Blob(base64.b64encode(bytes(range(256)) * 1000).decode(), chunk_size=1000).write_to(out)
+    256000
+    >>> out.getvalue() == bytes(range(256)) * 1000
+    True
+    """
+
+    def __init__(self, value: str, chunk_size: int = CHUNK_SIZE):
+        if any(char.isspace() for char in value):
+            value = "".join(value.split())
+        self.value = value
+        # base64 decodes in groups of 4 characters
+        self.chunk_size = max(4, chunk_size - chunk_size % 4)
+
+    def write_to(self, out: t.BinaryIO) -> int:
+        written = 0
+        for start in range(0, len(self.value), self.chunk_size):
+            chunk = base64.b64decode(self.value[start : start + self.chunk_size])
+            out.write(chunk)
+            written += len(chunk)
+        return written
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements a content addressed cache for decrypted secret files
+and the version state of vault KV v2 secrets, both stored encrypted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import typing as t
+from subprocess import run, PIPE  # nosec
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("DecryptCache", "VersionState")
+
+
+def file_digest(filename: str, chunk_size: int = 1 << 16) -> str:
+    """
+    Return the sha256 hexdigest of a files content.
+
+    >>> file_digest('tests/secrets.env') == file_digest('tests/secrets.env')
+    True
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_key(filename: str) -> list:
+    stat = os.stat(filename)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+class EncryptedStore:
+    """
+    A dictionary of entries, that is kept in a file encrypted with openssl,
+    using `secret` as passphrase. An unreadable file counts as empty.
+    """
+
+    def __init__(self, path: str, secret: str, cipher: str = "aes-256-cbc"):
+        self.path = path
+        self.secret = secret
+        self.cipher = cipher
+        self.dirty = False
+        self._entries = None
+        self._seen = set()
+
+    def _openssl(self, args: list, data: bytes) -> bytes:
+        proc = run(  # nosec
+            ["openssl", "enc", "-" + self.cipher, "-pbkdf2", "-a", "-A"]
+            + args
+            + ["-pass", "env:VAULTIFY_CACHE_SECRET"],
+            input=data,
+            stdout=PIPE,
+            stderr=PIPE,
+            env=dict(os.environ, VAULTIFY_CACHE_SECRET=self.secret),
+        )
+        if proc.returncode:
+            raise ChildProcessError(
+                "terminated with an non-zero value: {}".format(proc.stderr)
+            )
+        return proc.stdout
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isfile(self.path):
+                with open(self.path, "rb") as infile:
+                    try:
+                        self._entries = json.loads(self._openssl(["-d"], infile.read()))
+                    except (ChildProcessError, ValueError) as error:
+                        logger.warning(
+                            "discarding unreadable cache {}: {}".format(
+                                self.path, error
+                            )
+                        )
+        return self._entries
+
+    def save(self, prune: bool = True):
+        """
+        Write the store. With `prune`, entries that were not looked up are
+        dropped.
+        """
+        for key in set(self.entries) - self._seen if prune else ():
+            del self.entries[key]
+            self.dirty = True
+
+        if not self.dirty:
+            return
+
+        data = self._openssl(["-e", "-salt"], json.dumps(self.entries).encode())
+        tmp_path = "{}.{}".format(self.path, os.getpid())
+        with open(
+            os.open(tmp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "wb"
+        ) as out:
+            out.write(data)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        logger.info("saved {} entries to {}".format(len(self.entries), self.path))
+
+
+class DecryptCache(EncryptedStore):
+    """
+    Keep the parsed results of encrypted files between runs. An entry is valid,
+    when the (inode, size, mtime) of its file did not change. Otherwise the
+    content hash decides, so that a mere `touch` or copy does not cause another
+    decryption. The cache itself is stored encrypted with openssl, using
+    `secret` as passphrase.
+
+    >>> cache = DecryptCache('tests/new.cache', secret='abc')
+    >>> cache.lookup('tests/secrets.env') is None
+    True
+    >>> cache.store('tests/secrets.env', {'K1': 'a-plaintext-value'})
+    >>> cache.save()
+    >>> b'a-plaintext-value' in open('tests/new.cache', 'rb').read()
+    False
+    >>> DecryptCache('tests/new.cache', secret='abc').lookup('tests/secrets.env')
+    {'K1': 'a-plaintext-value'}
+    >>> DecryptCache('tests/new.cache', secret='wrong').lookup('tests/secrets.env')
+    """
+
+    def lookup(self, filename: str) -> t.Optional[dict]:
+        """
+        Return the cached data for `filename` or None, if it changed.
+        """
+        self._seen.add(filename)
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+
+        key = stat_key(filename)
+        if entry["stat"] == key:
+            logger.debug("cache hit for {}".format(filename))
+            return entry["data"]
+
+        if entry["sha256"] == file_digest(filename):
+            logger.debug("cache hit by content for {}".format(filename))
+            entry["stat"] = key
+            self.dirty = True
+            return entry["data"]
+
+        return None
+
+    def store(self, filename: str, data: dict):
+        self._seen.add(filename)
+        self.entries[filename] = {
+            "stat": stat_key(filename),
+            "sha256": file_digest(filename),
+            "data": data,
+        }
+        self.dirty = True
+
+
+class VersionState(EncryptedStore):
+    """
+    Remember the data of the last seen version of KV v2 secrets, so that only
+    paths with a newer version need to be read again.
+
+    >>> state = VersionState('tests/new.versions', secret='abc')
+    >>> state.store('secret/app', 2, {'K1': 'V1'})
+    >>> state.save()
+    >>> VersionState('tests/new.versions', secret='abc').lookup('secret/app', 2)
+    {'K1': 'V1'}
+    >>> VersionState('tests/new.versions', secret='abc').lookup('secret/app', 3)
+    """
+
+    def lookup(self, path: str, version: int) -> t.Optional[dict]:
+        """
+        Return the stored data of `path`, if it is still at `version`.
+        """
+        self._seen.add(path)
+        entry = self.entries.get(path)
+        if entry is None or entry["version"] != version:
+            return None
+        logger.debug("version {} of {} is unchanged".format(version, path))
+        return entry["data"]
+
+    def store(self, path: str, version: int, data: dict):
+        self._seen.add(path)
+        self.entries[path] = {"version": version, "data": data}
+        self.dirty = True
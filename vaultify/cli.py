@@ -2,33 +2,88 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import sys
+import os
 
 
-def main():
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    >>> parse_args([]).action
+    'run'
+    >>> args = parse_args(['batch', 'manifest.yml', '-w', '8'])
+    >>> args.action, args.manifest, args.workers
+    ('batch', 'manifest.yml', 8)
+    >>> parse_args(['--profile', '/tmp/p', '--profile-modes', 'sample']).profile
+    '/tmp/p'
+    >>> parse_args(['-c', 'tests/test-config.env', '-v', 'DEBUG']).config
+    'tests/test-config.env'
+    """
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("action", default="run")
+    parser.add_argument("action", nargs="?", default="run", choices=["run", "batch"])
+
+    parser.add_argument(
+        "manifest",
+        nargs="?",
+        default=None,
+        help="a yaml file with named provider/consumer jobs, used by the batch action",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of concurrent jobs for the batch action",
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        default=None,
+        help="write profiling reports for this run into DIR",
+    )
+
+    parser.add_argument(
+        "--profile-modes",
+        default="cpu",
+        help="comma separated profiling modes: cpu, memory, sample",
+    )
+
+    parser.add_argument(
+        "--profile-rate",
+        type=float,
+        default=1.0,
+        help="profile only this fraction of runs",
+    )
 
     parser.add_argument(
         "-v",
         "--verbosity",
         type=str,
-        default="WARN",
+        default=None,
         choices=["DEBUG", "INFO", "WARN", "CRIT"],
-        help="set logging verbosity",
+        help="set logging verbosity, overriding the configured levels",
     )
 
     parser.add_argument(
         "-c",
         "--config",
-        type=argparse.FileType("r"),
-        default=sys.stdin,
-        help="specify a configuration file to override defaults, if not specified, STDIN will be used",
+        metavar="FILE",
+        default=None,
+        help="a yaml configuration file, that overrides the default config files",
     )
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.action == "batch" and not args.manifest:
+        parser.error("the batch action needs a manifest")
+    if args.config and not os.path.isfile(args.config):
+        parser.error("no such config file: {}".format(args.config))
+    return args
+
+
+def main():
+    args = parse_args()
     print(args)
-    inp = args.config.read()
-    if inp:
-        print(inp)
+    if args.config:
+        with open(args.config) as infile:
+            print(infile.read())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements coordinating the vault reads of all vaultify processes
+on one host, to keep a mass restart from overloading vault.
+"""
+
+import atexit
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+import typing as t
+
+from .cache import EncryptedStore
+from .exceptions import ProviderError
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("SingleFlight", "TokenBucket", "private_dir")
+
+
+def private_dir(path: str = None) -> str:
+    """
+    Return a directory only the current user can access, creating it if
+    needed. It defaults to a tmpfs below /run/user, when there is one.
+
+    >>> oct(os.stat(private_dir('tests/new.shared')).st_mode & 0o777)
+    '0o700'
+    >>> os.chmod('tests/new.shared', 0o755)
+    >>> private_dir('tests/new.shared')  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    vaultify.exceptions.ProviderError: tests/new.shared must be private to uid ...
+    """
+    uid = os.getuid()
+    if path is None:
+        run_dir = "/run/user/{}".format(uid)
+        base = run_dir if os.path.isdir(run_dir) else tempfile.gettempdir()
+        path = os.path.join(base, "vaultify-{}".format(uid))
+
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != uid or stat.S_IMODE(info.st_mode) & 0o077:
+        raise ProviderError("{} must be private to uid {}".format(path, uid))
+    return path
+
+
+@contextlib.contextmanager
+def locked(filename: str):
+    """
+    Hold an exclusive lock on `filename` for all processes on this host.
+    """
+    fd = os.open(filename, os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+class SingleFlight:
+    """
+    Let only one process on the host perform a fetch, while all others wait
+    for it and reuse its result. Results are kept for `ttl` seconds in a
+    private directory, keyed on a hash of everything that identifies the
+    fetch, and encrypted with `secret`. The process, that stored a result,
+    removes it after `ttl` seconds or when it exits, whatever comes first.
+
+    >>> import glob
+    >>> flight = SingleFlight(private_dir('tests/new.flight'), ttl=5, secret='abc')
+    >>> calls = []
+    >>> def fetch():
+    ...     calls.append(1)
+    ...     time.sleep(0.1)
+    ...     return {"K1": "a-plaintext-value"}
+    >>> results = []
+    >>> threads = [
+    ...     threading.Thread(target=lambda: results.append(flight.fetch(("a", 1), fetch)))
+    ...     for _ in range(5)
+    ... ]
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> len(calls), results == [{"K1": "a-plaintext-value"}] * 5
+    (1, True)
+    >>> [result] = glob.glob('tests/new.flight/*.json')
+    >>> b'a-plaintext-value' in open(result, 'rb').read()
+    False
+    >>> flight.cleanup()
+    >>> glob.glob('tests/new.flight/*.json')
+    []
+
+    >>> flight = SingleFlight(private_dir('tests/new.flight'), ttl=0.2, secret='abc')
+    >>> flight.fetch(("b", 1), fetch)
+    {'K1': 'a-plaintext-value'}
+    >>> time.sleep(0.5)
+    >>> glob.glob('tests/new.flight/*.json')
+    []
+    """
+
+    def __init__(self, directory: str, ttl: float = 5.0, secret: str = ""):
+        self.directory = directory
+        self.ttl = ttl
+        self.secret = secret
+        self._stored = {}
+        self._stored_lock = threading.Lock()
+        atexit.register(self.cleanup)
+
+    def _key(self, parts: t.Iterable) -> str:
+        return hashlib.sha256(json.dumps(list(parts)).encode()).hexdigest()
+
+    def _paths(self, key: str) -> t.Tuple[str, str]:
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".lock"
+
+    def _load(self, result_file: str, expire: bool = False) -> t.Optional[dict]:
+        """
+        Return a result younger than `ttl`. With `expire`, which needs the
+        lock to be held, an older result is removed.
+        """
+        try:
+            age = time.time() - os.stat(result_file).st_mtime
+        except OSError:
+            return None
+        if age > self.ttl:
+            if expire:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(result_file)
+            return None
+        return EncryptedStore(result_file, self.secret).entries.get("result")
+
+    def _store(self, key: str, result_file: str, result: dict):
+        store = EncryptedStore(result_file, self.secret)
+        store.entries["result"] = result
+        store.dirty = True
+        store.save(prune=False)
+        with self._stored_lock:
+            self._stored[key] = os.stat(result_file).st_mtime_ns
+        timer = threading.Timer(self.ttl, self._remove, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _remove(self, key: str):
+        """
+        Remove the result stored by this process for `key`, unless another
+        process replaced it in the meantime.
+        """
+        with self._stored_lock:
+            mtime_ns = self._stored.pop(key, None)
+        if mtime_ns is None:
+            return
+
+        result_file, lock_file = self._paths(key)
+        with locked(lock_file):
+            with contextlib.suppress(FileNotFoundError):
+                if os.stat(result_file).st_mtime_ns == mtime_ns:
+                    os.unlink(result_file)
+                    logger.debug("removed the result of {}".format(key))
+
+    def cleanup(self):
+        """
+        Remove all results stored by this process.
+        """
+        for key in list(self._stored):
+            self._remove(key)
+
+    def fetch(self, parts: t.Iterable, func: t.Callable[[], dict]) -> dict:
+        key = self._key(parts)
+        result_file, lock_file = self._paths(key)
+
+        # results are replaced atomically, so they can be read without the lock
+        result = self._load(result_file)
+        if result is not None:
+            logger.debug("reusing the result of {}".format(key))
+            return result
+
+        with locked(lock_file):
+            # whoever held the lock before us may have fetched already
+            result = self._load(result_file, expire=True)
+            if result is not None:
+                logger.debug("reusing the result of {}".format(key))
+                return result
+
+            result = func()
+            self._store(key, result_file, result)
+            return result
+
+
+class TokenBucket:
+    """
+    A rate limit shared by all processes on the host: `rate` requests per
+    second on average, with bursts of up to `burst` requests.
+
+    >>> bucket = TokenBucket(private_dir('tests/new.bucket'), rate=5, burst=2)
+    >>> [round(bucket.acquire(), 2) > 0 for _ in range(3)]
+    [False, False, True]
+    """
+
+    def __init__(
+        self, directory: str, rate: float, burst: int = 10, name: str = "vault"
+    ):
+        self.state_file = os.path.join(directory, "{}.bucket".format(name))
+        self.rate = rate
+        self.burst = burst
+
+    def _take(self, fd: int) -> float:
+        """
+        Take a token and return 0, or return how long to wait for one.
+        """
+        now = time.time()
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            state = json.loads(os.read(fd, 1024) or b"{}")
+        except ValueError:
+            state = {}
+
+        tokens = min(
+            self.burst,
+            state.get("tokens", self.burst)
+            + (now - state.get("updated", now)) * self.rate,
+        )
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, json.dumps({"tokens": tokens, "updated": now}).encode())
+        return wait
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be made, return the seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with locked(self.state_file) as fd:
+                wait = self._take(fd)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
@@ -77,7 +77,10 @@ ENV_CFG = {
 }
 
 
-def configure(yaml_files: list = CFG_DEFAULT_FILES) -> dict:
+LOG_LEVELS = {"CRIT": "CRITICAL"}
+
+
+def configure(yaml_files: list = CFG_DEFAULT_FILES, verbosity: str = None) -> dict:
 
     """
         This populates the global config dictionary with merged values
@@ -88,7 +91,17 @@ def configure(yaml_files: list = CFG_DEFAULT_FILES) -> dict:
     >>> all([cfg['loggers'],cfg['handlers'],cfg['vaultify'],cfg['formatters'],])
     True
 
+    Later files override earlier ones and `verbosity` overrides all levels:
+    >>> with open('tests/new.config.yml', 'w') as out:
+    ...     _ = out.write('vaultify:\\n  profile:\\n    dir: /tmp/p\\n')
+    >>> cfg = configure(CFG_DEFAULT_FILES + ['tests/new.config.yml'], verbosity='CRIT')
+    >>> cfg['vaultify']['profile']
+    {'dir': '/tmp/p'}
+    >>> cfg['loggers']['']['level'], cfg['handlers']['console']['level']
+    ('CRITICAL', 'CRITICAL')
+
     :param yaml_files: a list off yaml filenames that could exist
+    :param verbosity: a log level for all loggers and handlers
     :return: the final global config dict
     """
     config_data = yaml_dict_merge(LOG_CFG, BASE_CFG)
@@ -101,6 +114,12 @@ def configure(yaml_files: list = CFG_DEFAULT_FILES) -> dict:
 
     config_data = yaml_dict_merge(config_data, ENV_CFG)
 
+    if verbosity:
+        level = LOG_LEVELS.get(verbosity, verbosity)
+        for section in ("handlers", "loggers"):
+            for entry in config_data[section].values():
+                entry["level"] = level
+
     return config_data
 
 
@@ -10,15 +10,44 @@ import typing as t
 import os
 import yaml
 import json
-from subprocess import run, PIPE  # nosec
-from . import util
+import collections
+import signal
+import sys
+import threading
+import time
+from subprocess import run, Popen, PIPE  # nosec
+from . import util, memfd
 
 from .base import Consumer
+from .blobs import Blob
+from .exceptions import ConsumerError
 
-__all__ = ("DotEnvWriter", "JsonWriter", "EnvRunner")
+__all__ = ("DotEnvWriter", "JsonWriter", "EnvRunner", "BlobWriter", "MemfdRunner")
 
 logger = logging.getLogger(__name__)
 
+YAML_DUMPER = getattr(yaml, "CDumper", yaml.Dumper)
+
+
+def text_only(consumer: Consumer, data: dict) -> dict:
+    """
+    Refuse binary secrets in Consumers, that can only handle text.
+
+    >>> from .blobs import FileBlob
+    >>> text_only('JsonWriter', {'K1': FileBlob('tests/secrets.env')})
+    Traceback (most recent call last):
+    ...
+    vaultify.exceptions.ConsumerError: JsonWriter can not consume the binary secret K1, use a BlobWriter
+    """
+    for key, value in data.items():
+        if isinstance(value, Blob):
+            raise ConsumerError(
+                "{} can not consume the binary secret {}, use a BlobWriter".format(
+                    consumer, key
+                )
+            )
+    return data
+
 
 class FileWriter:
     """
@@ -35,12 +64,24 @@ class FileWriter:
         self.mode = mode
         self.overwrite = overwrite
 
-    def _write_data_to_fd(self, data: str):
-        with open(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o200), "w") as file_out:
-            logger.info("writing to {}, mode {}".format(self.path, oct(self.mode)))
-
-            file_out.write(data)
-            file_out.write("\n")
+    def _write_data_to_fd(self, dump: t.Callable[[t.TextIO], None]):
+        # dump into a file next to the target, so that a failing dump never
+        # leaves the target truncated or half written
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(
+                os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o200),
+                "w",
+                encoding="utf-8",
+            ) as file_out:
+                logger.info("writing to {}, mode {}".format(self.path, oct(self.mode)))
+
+                dump(file_out)
+                file_out.write("\n")
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
 
     def write(self, data: str):
         """
@@ -57,12 +98,35 @@ class FileWriter:
         >>> open('tests/new.filewriter', 'r').read()
         'def\\n'
         """
+        self.write_with(lambda file_out: file_out.write(data))
+
+    def write_with(self, dump: t.Callable[[t.TextIO], None]):
+        """
+        Like `write`, but `dump` serializes straight into the open file, so
+        that the output never has to exist as a whole in memory.
+
+        >>> fw = FileWriter('tests/new.filewriter', overwrite=True)
+        >>> fw.write_with(lambda file_out: file_out.writelines(['a', 'b']))
+        >>> open('tests/new.filewriter', 'r').read()
+        'ab\\n'
+
+        A failing `dump` leaves the previous file untouched:
+        >>> def broken(file_out):
+        ...     file_out.write('half')
+        ...     raise ValueError('broken')
+        >>> fw.write_with(broken)
+        Traceback (most recent call last):
+        ...
+        ValueError: broken
+        >>> open('tests/new.filewriter', 'r').read()
+        'ab\\n'
+        """
         if not os.path.exists(self.path):
-            self._write_data_to_fd(data)
+            self._write_data_to_fd(dump)
         else:
             if self.overwrite:
                 logger.warning("overwriting {}".format(self.path))
-                self._write_data_to_fd(data)
+                self._write_data_to_fd(dump)
             else:
                 logger.warning("{} already exists: skip".format(self.path))
 
@@ -79,38 +143,155 @@ class DotEnvWriter(Consumer, FileWriter):
     "export K1='V1'\\nexport K2='V2'\\n"
     """
 
+    def _dump(self, data: dict, file_out: t.TextIO):
+        for index, line in enumerate(util.dict2env(data)):
+            if index:
+                file_out.write("\n")
+            file_out.write(line)
+
     def consume_secrets(self, data: dict):
-        self.write("\n".join(util.dict2env(data)))
+        text_only(self, data)
+        self.write_with(lambda file_out: self._dump(data, file_out))
 
 
 class JsonWriter(Consumer, FileWriter):
     """
-    This Consumer writes secrets as a JSON dictionary
+    This Consumer writes secrets as a JSON dictionary. Flat dictionaries are
+    written key by key.
 
     >>> JsonWriter('tests/new.json', overwrite=True).consume_secrets({"K1":"V1","K2":"V2"})
     >>> open('tests/new.json').read()
     '{\\n  "K1": "V1",\\n  "K2": "V2"\\n}\\n'
+    >>> data = {"K2": "it's \\"x\\"", "K1": "\\u00fc", "K3": 1, "K4": None}
+    >>> JsonWriter('tests/new.json', overwrite=True).consume_secrets(data)
+    >>> open('tests/new.json').read()[:-1] == json.dumps(data, sort_keys=True, indent=2)
+    True
     """
 
+    def _dump(self, data: dict, file_out: t.TextIO):
+        if not data or not all(
+            isinstance(value, (str, int, float, bool, type(None)))
+            for value in data.values()
+        ):
+            json.dump(data, file_out, sort_keys=True, indent=2)
+            return
+
+        file_out.write("{")
+        for index, key in enumerate(sorted(data)):
+            file_out.write(",\n  " if index else "\n  ")
+            file_out.write(json.dumps(key))
+            file_out.write(": ")
+            file_out.write(json.dumps(data[key]))
+        file_out.write("\n}")
+
     def consume_secrets(self, data: dict):
-        self.write(json.dumps(data, sort_keys=True, indent=2))
+        text_only(self, data)
+        self.write_with(lambda file_out: self._dump(data, file_out))
 
 
 class YamlWriter(Consumer, FileWriter):
     """
-    This Consumer writes secrets as a YAML dictionary
+    This Consumer writes secrets as a YAML dictionary, using the libyaml
+    based dumper, when PyYAML was built with it. Flat dictionaries are emitted
+    key by key, so that no representation of the whole document is built.
 
     >>> YamlWriter('tests/new.yaml', overwrite=True).consume_secrets({"K1":"V1","K2":"V2"})
     >>> open('tests/new.yaml').read()
     'K1: V1\\nK2: V2\\n\\n'
+    >>> data = {"K2": "yes", "K1": "it's", "K3": "a\\nb", "K4": 1, "K5": None}
+    >>> YamlWriter('tests/new.yaml', overwrite=True).consume_secrets(data)
+    >>> open('tests/new.yaml').read()[:-1] == yaml.dump(data, default_flow_style=False)
+    True
     """
 
-    def consume_secrets(self, data: dict):
-        self.write(
-            yaml.dump(
-                data, default_flow_style=False, allow_unicode=True, encoding="utf-8"
-            ).decode()
+    dump_kwargs = dict(default_flow_style=False, allow_unicode=True)
+
+    @staticmethod
+    def _scalar_event(dumper, value) -> yaml.ScalarEvent:
+        node = dumper.represent_data(value)
+        implicit = (
+            node.tag == dumper.resolve(yaml.ScalarNode, node.value, (True, False)),
+            node.tag == dumper.resolve(yaml.ScalarNode, node.value, (False, True)),
         )
+        return yaml.ScalarEvent(None, node.tag, implicit, node.value, style=node.style)
+
+    def _dump(self, data: dict, file_out: t.TextIO):
+        if not data or not all(
+            isinstance(value, (str, int, float, bool, type(None)))
+            for value in data.values()
+        ):
+            yaml.dump(data, file_out, Dumper=YAML_DUMPER, **self.dump_kwargs)
+            return
+
+        dumper = YAML_DUMPER(file_out, **self.dump_kwargs)
+        try:
+            dumper.emit(yaml.StreamStartEvent())
+            dumper.emit(yaml.DocumentStartEvent(explicit=False))
+            dumper.emit(yaml.MappingStartEvent(None, None, True, flow_style=False))
+            for key in sorted(data):
+                dumper.emit(self._scalar_event(dumper, key))
+                dumper.emit(self._scalar_event(dumper, data[key]))
+            dumper.emit(yaml.MappingEndEvent())
+            dumper.emit(yaml.DocumentEndEvent(explicit=False))
+            dumper.emit(yaml.StreamEndEvent())
+        finally:
+            dumper.dispose()
+
+    def consume_secrets(self, data: dict):
+        text_only(self, data)
+        self.write_with(lambda file_out: self._dump(data, file_out))
+
+
+class BlobWriter(Consumer):
+    """
+    This Consumer writes every secret into its own file below the directory
+    `path`, named like its key. Binary secrets are streamed into the file
+    chunk by chunk, text secrets are written utf-8 encoded.
+
+    >>> from .blobs import Base64Blob
+    >>> BlobWriter('tests/new.blobs', overwrite=True).consume_secrets(
+    ...     {"K1": "V1", "cert.p12": Base64Blob("AAEC")})
+    >>> open('tests/new.blobs/cert.p12', 'rb').read()
+    b'\\x00\\x01\\x02'
+    >>> oct(os.stat('tests/new.blobs/K1').st_mode & 0o777)
+    '0o600'
+    >>> BlobWriter('tests/new.blobs').consume_secrets({"../K1": "V1"})
+    Traceback (most recent call last):
+    ...
+    vaultify.exceptions.ConsumerError: ../K1 is not usable as a filename
+    """
+
+    def __init__(self, path: str, mode: oct = 0o600, overwrite: bool = False):
+        self.path = path
+        self.mode = mode
+        self.overwrite = overwrite
+
+    def _write(self, target: str, value: t.Union[str, Blob]):
+        tmp_path = "{}.{}.tmp".format(target, os.getpid())
+        try:
+            fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, self.mode)
+            with open(fd, "wb") as file_out:
+                if isinstance(value, Blob):
+                    value.write_to(file_out)
+                else:
+                    file_out.write(str(value).encode("utf-8"))
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def consume_secrets(self, data: dict):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        for key, value in data.items():
+            if key in (".", "..") or os.path.basename(key) != key:
+                raise ConsumerError("{} is not usable as a filename".format(key))
+
+            target = os.path.join(self.path, key)
+            if os.path.exists(target) and not self.overwrite:
+                logger.warning("{} already exists: skip".format(target))
+                continue
+            logger.info("writing to {}, mode {}".format(target, oct(self.mode)))
+            self._write(target, value)
 
 
 class EnvRunner(Consumer):
@@ -130,21 +311,150 @@ class EnvRunner(Consumer):
     Traceback (most recent call last):
     ...
     FileNotFoundError: [Errno 2] No such file or directory: 'nowhere.sh'
+
+    With `processes`, it becomes a supervisor: the environment is prepared
+    once and shared by that many children, which run with the inherited
+    stdout. Crashed children are restarted with the same environment, unless
+    the Provider reports changed secrets:
+    >>> runner = EnvRunner('./tests/crash-once.sh tests/new.prefork', processes=1)
+    >>> runner.interval = 0.01
+    >>> runner.consume_secrets({"K1": "V1"})
+    >>> open('tests/new.prefork').read(), runner.restarts
+    ('V1\\nV1\\n', 1)
+
+    A Provider, that fails to refresh, does not stop the healthy children,
+    the crashed one is restarted with the environment it had:
+    >>> from .exceptions import ProviderError
+    >>> def refresh():
+    ...     raise ProviderError("vault is down")
+    >>> runner = EnvRunner('./tests/crash-once.sh tests/new.prefork.down', processes=1)
+    >>> runner.interval, runner.refresh = 0.01, refresh
+    >>> runner.consume_secrets({"K1": "V1"})
+    >>> open('tests/new.prefork.down').read(), runner.restarts
+    ('V1\\nV1\\n', 1)
+
+    Children, that keep crashing, are given up and fail the run:
+    >>> runner = EnvRunner('false', processes=2, max_restarts=1)
+    >>> runner.interval = 0.01
+    >>> runner.consume_secrets({"K1": "V1"})
+    Traceback (most recent call last):
+    ...
+    vaultify.exceptions.ConsumerError: gave up on 2 of 2 children of ['false']
     """
 
-    def __init__(self, path: str):
+    def __init__(
+        self,
+        path: str,
+        processes: int = None,
+        max_restarts: int = 10,
+        interval: float = 0.5,
+    ):
         self.path = os.environ.get("VAULTIFY_TARGET", path).split()
+        self.processes = int(os.environ.get("VAULTIFY_PROCESSES", processes or 0))
+        self.max_restarts = max_restarts
+        self.interval = interval
+        self.restarts = 0
 
-    def consume_secrets(self, data: dict):
+    def _prepare_env(self, data: dict) -> dict:
+        text_only(self, data)
         prepared_env = dict(os.environ)
 
         for key, value in data.items():
             prepared_env.update({key: value})
         logger.info("{} enriched the environment".format(self))
+        return prepared_env
+
+    def popen_kwargs(self) -> dict:
+        """
+        Extra arguments for spawning the target process.
+        """
+        return {}
+
+    def _spawn(self, prepared_env: dict) -> Popen:
+        proc = Popen(self.path, env=prepared_env, **self.popen_kwargs())  # nosec
+        logger.info('running the process "{}" as {}'.format(self.path, proc.pid))
+        return proc
+
+    def _stop_children(self, children: dict):
+        for proc in children.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in children.values():
+            proc.wait()
+
+    def supervise(self, prepared_env: dict):
+        """
+        Run `processes` children with the prepared environment and restart
+        those, that crash, until all of them exited cleanly. Raises a
+        ConsumerError, when children were given up after `max_restarts`.
+        """
+        children = {slot: self._spawn(prepared_env) for slot in range(self.processes)}
+        crashes = collections.Counter()
+        given_up = 0
+
+        if threading.current_thread() is threading.main_thread():
+            # run the cleanup below, when our container is stopped
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+        try:
+            while children:
+                time.sleep(self.interval)
+                for slot, proc in list(children.items()):
+                    returncode = proc.poll()
+                    if returncode is None:
+                        continue
+                    if returncode == 0:
+                        logger.info("child {} exited".format(proc.pid))
+                        del children[slot]
+                        continue
+
+                    crashes[slot] += 1
+                    logger.warning(
+                        "child {} crashed with {}".format(proc.pid, returncode)
+                    )
+                    if crashes[slot] > self.max_restarts:
+                        logger.critical("giving up on child slot {}".format(slot))
+                        del children[slot]
+                        given_up += 1
+                        continue
+
+                    try:
+                        fresh = self.refresh() if self.refresh else None
+                    except Exception as error:
+                        logger.critical(
+                            "could not refresh the secrets, restarting with the "
+                            "previous ones: {}".format(error)
+                        )
+                        fresh = None
+                    if fresh is not None:
+                        prepared_env = self._prepare_env(fresh)
+                    children[slot] = self._spawn(prepared_env)
+                    self.restarts += 1
+        finally:
+            self._stop_children(children)
+
+        if given_up:
+            raise ConsumerError(
+                "gave up on {} of {} children of {}".format(
+                    given_up, self.processes, self.path
+                )
+            )
+
+    def consume_secrets(self, data: dict):
+        prepared_env = self._prepare_env(data)
+
+        if self.processes:
+            return self.supervise(prepared_env)
 
         try:
             # TODO Overhaul this
-            proc = run(self.path, stdout=PIPE, stderr=PIPE, env=prepared_env)
+            proc = run(
+                self.path,
+                stdout=PIPE,
+                stderr=PIPE,
+                env=prepared_env,
+                **self.popen_kwargs()
+            )
             logger.info('running the process "{}"'.format(self.path))
 
         except FileNotFoundError as error:
@@ -152,3 +462,57 @@ class EnvRunner(Consumer):
             raise error
 
         print(proc.stdout.decode())
+
+
+class MemfdRunner(EnvRunner):
+    """
+    This Consumer runs a subprocess like `EnvRunner`, but hands the secrets
+    over in a sealed memfd instead of the environment, so they show up in
+    neither `/proc/<pid>/environ` nor on any disk. The child finds the
+    descriptor number in `$VAULTIFY_MEMFD` and reads the bundle with
+    `vaultify.memfd.read_secrets`, by mapping it, or from
+    `/proc/self/fd/$VAULTIFY_MEMFD`. This is only available on Linux.
+
+    >>> MemfdRunner('./tests/echo-memfd.sh').consume_secrets({"K9": "V9"})
+    K9=
+    {"K9": "V9"}
+    """
+
+    def __init__(
+        self, path: str, env_var: str = "VAULTIFY_MEMFD", fmt: str = "json", **kwargs
+    ):
+        if not hasattr(os, "memfd_create"):
+            raise ConsumerError(
+                "{} needs memfd_create, which is Linux only".format(self)
+            )
+        if fmt not in memfd.FORMATS:
+            raise ConsumerError("{} is not a memfd bundle format".format(fmt))
+
+        super().__init__(path, **kwargs)
+        self.env_var = env_var
+        self.fmt = fmt
+        self._fd = None
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _prepare_env(self, data: dict) -> dict:
+        text_only(self, data)
+        self._close()
+        self._fd = memfd.create_bundle(data, self.fmt)
+
+        prepared_env = dict(os.environ)
+        prepared_env[self.env_var] = str(self._fd)
+        logger.info("{} sealed the secrets into a memfd".format(self))
+        return prepared_env
+
+    def popen_kwargs(self) -> dict:
+        return {"pass_fds": (self._fd,)}
+
+    def consume_secrets(self, data: dict):
+        try:
+            return super().consume_secrets(data)
+        finally:
+            self._close()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements handing secrets to child processes through a sealed
+memfd, an anonymous in-memory file, that never touches a disk.
+
+The child side only needs `read_secrets`, or it maps the descriptor named
+by `$VAULTIFY_MEMFD` itself.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import shlex
+import typing as t
+
+from . import util
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("create_bundle", "map_bundle", "read_secrets", "FORMATS")
+
+FORMATS = ("json", "env")
+SEALS = ("F_SEAL_SEAL", "F_SEAL_SHRINK", "F_SEAL_GROW", "F_SEAL_WRITE")
+
+
+def create_bundle(data: dict, fmt: str = "json") -> int:
+    """
+    Write `data` into a new memfd, seal it against any change and return the
+    descriptor. The descriptor is not inherited, unless passed explicitly.
+
+    >>> fd = create_bundle({"K1": "V1"})
+    >>> os.write(fd, b"x")
+    Traceback (most recent call last):
+    ...
+    PermissionError: [Errno 1] Operation not permitted
+    >>> os.close(fd)
+    """
+    if fmt not in FORMATS:
+        raise ValueError("unknown bundle format: {}".format(fmt))
+
+    fd = os.memfd_create("vaultify", os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    try:
+        with open(fd, "w", encoding="utf-8", closefd=False) as bundle:
+            if fmt == "json":
+                json.dump(data, bundle)
+            else:
+                for line in util.dict2env(data):
+                    bundle.write(line)
+                    bundle.write("\n")
+        seals = 0
+        for seal in SEALS:
+            seals |= getattr(fcntl, seal)
+        fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals)
+    except Exception:
+        os.close(fd)
+        raise
+    logger.debug("sealed {} secrets into memfd {}".format(len(data), fd))
+    return fd
+
+
+def map_bundle(fd: int) -> mmap.mmap:
+    """
+    Map a bundle read only, without copying it.
+
+    >>> fd = create_bundle({"K1": "V1"})
+    >>> map_bundle(fd)[:]
+    b'{"K1": "V1"}'
+    >>> os.close(fd)
+    """
+    return mmap.mmap(fd, 0, mmap.MAP_SHARED, mmap.PROT_READ)
+
+
+def read_secrets(
+    env_var: str = "VAULTIFY_MEMFD", environ: t.Mapping = os.environ
+) -> dict:
+    """
+    Read the bundle, whose descriptor is named by `env_var`, in the child.
+
+    >>> for fmt in FORMATS:
+    ...     fd = create_bundle({"K1": "V1", "K2": "it's\\nmultiline"}, fmt=fmt)
+    ...     print(read_secrets(environ={"VAULTIFY_MEMFD": str(fd)}))
+    ...     os.close(fd)
+    {'K1': 'V1', 'K2': "it's\\nmultiline"}
+    {'K1': 'V1', 'K2': "it's\\nmultiline"}
+    """
+    fd = int(environ[env_var])
+    if not os.fstat(fd).st_size:
+        return {}
+    with map_bundle(fd) as bundle:
+        content = bundle[:].decode("utf-8")
+
+    if content.startswith("{"):
+        return json.loads(content)
+
+    secrets = {}
+    for token in shlex.split(content):
+        if token != "export":
+            key, _, value = token.partition("=")
+            secrets[key] = value
+    return secrets
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements the optional profiling of vaultify runs.
+
+Reports only ever contain code locations, timings and allocation sizes,
+never any values handled by vaultify.
+"""
+
+import collections
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("Profiler", "MODES")
+
+MODES = ("cpu", "memory", "sample")
+
+
+class StackSampler:
+    """
+    A statistical profiler, which looks at the stacks of all threads every
+    `interval` seconds and counts the collapsed stacks, prefixed with the
+    thread name. Its overhead does not depend on the number of function
+    calls, so it is cheap enough for production runs.
+
+    >>> def spin():
+    ...     deadline = time.monotonic() + 0.1
+    ...     while time.monotonic() < deadline:
+    ...         pass
+    >>> sampler = StackSampler(interval=0.001)
+    >>> sampler.start()
+    >>> worker = threading.Thread(target=spin, name="worker")
+    >>> worker.start(); worker.join()
+    >>> sampler.stop()
+    >>> any(
+    ...     stack.startswith("worker;") and stack.endswith(":spin")
+    ...     for stack in sampler.stacks
+    ... )
+    True
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _collapse(self, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+            )
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _loop(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stack = self._collapse(frame)
+                    name = names.get(ident, str(ident))
+                    self.stacks["{};{}".format(name, stack)] += 1
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="vaultify-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, filename: str):
+        """
+        Write the stacks in the collapsed format, that flamegraph tools read.
+        """
+        with open(filename, "w") as out:
+            for stack, count in self.stacks.most_common():
+                out.write("{} {}\n".format(stack, count))
+
+
+class Profiler:
+    """
+    Profile named sections of a vaultify run and write one report per
+    section and mode into `directory`. With `rate` below 1, only that
+    fraction of runs is profiled at all.
+
+    >>> import glob
+    >>> profiler = Profiler('tests/new.profile', modes=['cpu', 'memory'])
+    >>> with profiler.section('run'):
+    ...     secret = {'K1': 'do-not-leak-me' * 10}
+    >>> sorted(name.split('-')[0] for name in os.listdir('tests/new.profile'))
+    ['run', 'run']
+    >>> any(
+    ...     'do-not-leak-me' in open(os.path.join('tests/new.profile', name), 'rb').read().decode('latin1')
+    ...     for name in os.listdir('tests/new.profile')
+    ... )
+    False
+
+    Threads started inside a section, like the jobs of a `Batch`, are
+    profiled, too:
+    >>> from .batch import Batch
+    >>> profiler = Profiler('tests/new.profile/batch', modes=['cpu', 'sample'])
+    >>> with profiler.section('batch'):
+    ...     _ = Batch({"jobs": {"json": {
+    ...         "provider": {"class": "PlainTextProvider"},
+    ...         "consumer": {"class": "JsonWriter",
+    ...                      "args": {"path": "tests/new.batch.json", "overwrite": True}},
+    ...     }}}).run()
+    >>> [report] = glob.glob('tests/new.profile/batch/*.pstats')
+    >>> functions = {name for _, _, name in pstats.Stats(report).stats}
+    >>> {'_run_job', 'get_secrets', 'consume_secrets'} <= functions
+    True
+
+    A disabled profiler does nothing:
+    >>> Profiler('tests/new.profile', modes=['cpu'], rate=0).enabled
+    False
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        modes: t.Iterable[str] = ("cpu",),
+        rate: float = 1.0,
+        top: int = 25,
+        interval: float = 0.005,
+    ):
+        self.modes = set(modes)
+        unknown = self.modes - set(MODES)
+        if unknown:
+            raise ValueError("unknown profiling modes: {}".format(sorted(unknown)))
+
+        self.directory = directory
+        self.top = top
+        self.interval = interval
+        self.enabled = bool(self.modes) and random.random() < rate  # nosec
+        if self.enabled:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, cfg: dict) -> "Profiler":
+        """
+        Create a Profiler from the `profile` section of the vaultify config.
+
+        >>> Profiler.from_config({}).enabled
+        False
+        >>> Profiler.from_config({'dir': 'tests/new.profile', 'modes': 'sample'}).modes
+        {'sample'}
+        """
+        modes = cfg.get("modes", ())
+        if isinstance(modes, str):
+            modes = modes.split(",")
+        return cls(
+            cfg.get("dir") or ".",
+            modes=modes if cfg.get("dir") else (),
+            rate=float(cfg.get("rate", 1.0)),
+            top=int(cfg.get("top", 25)),
+            interval=float(cfg.get("interval", 0.005)),
+        )
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(
+            self.directory,
+            "{}-{}-{}.{}".format(name, os.getpid(), int(time.time()), suffix),
+        )
+
+    def _dump_allocations(self, name: str, snapshot):
+        snapshot = snapshot.filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+        stats = snapshot.statistics("lineno")
+        with open(self._path(name, "alloc.txt"), "w") as out:
+            out.write("top {} allocations in {}\n".format(self.top, name))
+            for stat in stats[: self.top]:
+                out.write("{}\n".format(stat))
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        """
+        Profile everything that runs inside this context as `name`.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        cpu = cProfile.Profile() if "cpu" in self.modes else None
+        sampler = StackSampler(self.interval) if "sample" in self.modes else None
+        memory = "memory" in self.modes and not tracemalloc.is_tracing()
+        thread_profiles = []
+
+        def profile_thread(*args):
+            # runs once in every new thread and hands it to its own profile
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # from python 3.12 on, the section profile sees all threads
+                sys.setprofile(None)
+                return
+            thread_profiles.append(profile)
+
+        if memory:
+            tracemalloc.start()
+        if sampler:
+            sampler.start()
+        if cpu:
+            threading.setprofile(profile_thread)
+            cpu.enable()
+        try:
+            yield
+        finally:
+            if cpu:
+                cpu.disable()
+                threading.setprofile(None)
+            if sampler:
+                sampler.stop()
+            if memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                self._dump_allocations(name, snapshot)
+            if cpu:
+                stats = pstats.Stats(cpu)
+                for profile in thread_profiles:
+                    stats.add(profile)
+                stats.dump_stats(self._path(name, "pstats"))
+            if sampler:
+                sampler.dump(self._path(name, "stacks.txt"))
+            logger.info("wrote profile of {} to {}".format(name, self.directory))
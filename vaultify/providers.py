@@ -4,23 +4,148 @@
 This file implements various secret Provider classes.
 """
 
+import base64
+import hashlib
 import logging
 import os
 import glob
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import PIPE
 import hvac
 from .util import env2dict, run_process
 from .base import Provider
+from .renewal import RenewalScheduler, token_methods
+from .cache import DecryptCache, VersionState, stat_key
+from .blobs import Base64Blob, Blob, FileBlob, ProcessBlob
+from .routing import ReadRouter, parse_nodes
+from .coalesce import SingleFlight, TokenBucket, private_dir
+from .exceptions import ProviderError
 
 logger = logging.getLogger(__name__)
 
 
-__all__ = ("VaultProvider", "GPGProvider", "OpenSSLProvider", "PlainTextProvider")
+__all__ = (
+    "VaultProvider",
+    "GPGProvider",
+    "OpenSSLProvider",
+    "PlainTextProvider",
+    "TransitProvider",
+)
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def vault_client(addr: str, token: str) -> hvac.Client:
+    """
+    Return the hvac.Client for `addr` and `token`. Providers in one process
+    share their clients, and with that their connection pools.
+
+    >>> vault_client('http://127.0.0.1:8200', 'a') is vault_client('http://127.0.0.1:8200', 'a')
+    True
+    >>> vault_client('http://127.0.0.1:8200', 'a') is vault_client('http://127.0.0.1:8200', 'b')
+    False
+    """
+    with _CLIENTS_LOCK:
+        if (addr, token) not in _CLIENTS:
+            _CLIENTS[(addr, token)] = hvac.Client(url=addr, token=token)
+        return _CLIENTS[(addr, token)]
 
 
 class VaultProvider(Provider):
     """
     This is the original Provider which uses HashiCorp Vault to fetch secrets.
+
+    With `renew` enabled, the token and all secret leases are renewed in the
+    background at `renew_fraction` of their TTL. Secrets stay cached between
+    calls to `get_secrets`, and a path is only read again when its lease can
+    not be renewed anymore.
+
+    Values of the keys listed in `blobs` are base64 encoded binary secrets and
+    are provided as `Base64Blob`.
+
+    `addr` may list several vault nodes with role hints, like
+    `https://a:8200=active,https://b:8200=standby,https://c:8200=replica`.
+    Reads are then routed to the fastest healthy node by a `ReadRouter`.
+
+    To spare vault a thundering herd, when many processes on a host start at
+    once, `coalesce` lets only one of them read a path, while the others reuse
+    its response for `coalesce_ttl` seconds. `jitter` delays the first read
+    by up to that many seconds and `rate_limit` caps the reads of all
+    processes on the host per second, allowing bursts of `burst` reads.
+
+    With a `kv2_state` file, `paths` are secrets of the KV v2 engine mounted at
+    `kv2_mount`. Only their metadata is read, and their data only when the
+    version advanced since the last run. The data of all other paths comes
+    from the state file, which is encrypted with `state_secret` or the token.
+
+    >>> from tests.fakevault import FakeVault
+    >>> down = FakeVault(sealed=True).start()
+    >>> replica = FakeVault({"secret/app": {"K1": "V1"}}).start()
+    >>> VaultProvider(
+    ...     paths="secret/app",
+    ...     token="t",
+    ...     addr="{}=active,{}=replica".format(down.addr, replica.addr),
+    ... ).get_secrets()
+    {'secret/app': {'K1': 'V1'}}
+    >>> down.stop(); replica.stop()
+
+    >>> import threading
+    >>> vault = FakeVault({"secret/app": {"K1": "V1"}}, delay=0.1).start()
+    >>> providers = [
+    ...     VaultProvider(
+    ...         paths="secret/app",
+    ...         token="t",
+    ...         addr=vault.addr,
+    ...         coalesce=True,
+    ...         shared_dir="tests/new.coalesce",
+    ...         jitter=0.05,
+    ...         rate_limit=20,
+    ...     )
+    ...     for _ in range(5)
+    ... ]
+    >>> threads = [threading.Thread(target=p.get_secrets) for p in providers]
+    >>> for thread in threads: thread.start()
+    >>> for thread in threads: thread.join()
+    >>> vault.requests
+    [('GET', '/v1/secret/app')]
+    >>> vault.stop()
+
+    >>> vault = FakeVault().start()
+    >>> current = {"version": 1, "data": {"K1": "V1"}}
+    >>> vault.handlers["secret/metadata/app"] = lambda method, body: (
+    ...     200, {"data": {"current_version": current["version"]}})
+    >>> vault.handlers["secret/data/app"] = lambda method, body: (
+    ...     200, {"data": {"data": current["data"],
+    ...                    "metadata": {"version": current["version"]}}})
+    >>> def poll():
+    ...     del vault.requests[:]
+    ...     secrets = VaultProvider(
+    ...         paths="secret/app", token="t", addr=vault.addr,
+    ...         kv2_state="tests/new.versions.state",
+    ...     ).get_secrets()
+    ...     return secrets, [path for _, path in vault.requests]
+    >>> poll()
+    ({'secret/app': {'K1': 'V1'}}, ['/v1/secret/metadata/app', '/v1/secret/data/app'])
+    >>> poll()
+    ({'secret/app': {'K1': 'V1'}}, ['/v1/secret/metadata/app'])
+    >>> current.update(version=2, data={"K1": "V2"})
+    >>> poll()
+    ({'secret/app': {'K1': 'V2'}}, ['/v1/secret/metadata/app', '/v1/secret/data/app'])
+
+    Lazy reads of single sources keep the state, too:
+    >>> os.unlink("tests/new.versions.state")
+    >>> VaultProvider(
+    ...     paths="secret/app", token="t", addr=vault.addr,
+    ...     kv2_state="tests/new.versions.state",
+    ... ).get_source("secret/app")
+    {'K1': 'V2'}
+    >>> poll()
+    ({'secret/app': {'K1': 'V2'}}, ['/v1/secret/metadata/app'])
+    >>> vault.stop()
     """
 
     def __init__(
@@ -28,37 +153,296 @@ class VaultProvider(Provider):
         paths: str = None,
         token: str = os.environ.get("VAULTIFY_SECRET"),
         addr: str = None,
+        renew: bool = False,
+        renew_fraction: float = 0.66,
+        blobs: str = "",
+        coalesce: bool = False,
+        coalesce_ttl: float = 5.0,
+        shared_dir: str = None,
+        jitter: float = 0.0,
+        rate_limit: float = 0.0,
+        burst: int = 10,
+        kv2_state: str = None,
+        kv2_mount: str = "secret",
+        state_secret: str = None,
     ):
 
         self.token = os.environ.get("VAULT_TOKEN", token)
         self.addr = os.environ.get("VAULT_ADDR", addr)
         self.paths = os.environ.get("VAULT_PATHS", paths).split(",")
+        self.blobs = set(filter(None, blobs.split(",")))
+
+        nodes = parse_nodes(self.addr) if self.addr else []
+        self.router = None
+        if len(nodes) > 1:
+            self.router = ReadRouter(nodes, self.token)
+            self.client = self.router.primary.client
+        else:
+            self.client = vault_client(nodes[0][0] if nodes else None, self.token)
+        self.cache = {}
+        self._changed = False
+        self.scheduler = None
+        if renew:
+            self.scheduler = RenewalScheduler(
+                self.client, refetch=self._refetch, fraction=renew_fraction
+            )
+
+        self.jitter = jitter
+        self.flight = self.bucket = None
+        if coalesce or rate_limit:
+            directory = private_dir(shared_dir)
+            if coalesce:
+                # processes only share responses, when they share the token
+                self.flight = SingleFlight(
+                    directory, ttl=coalesce_ttl, secret=self.token or ""
+                )
+            if rate_limit:
+                self.bucket = TokenBucket(directory, rate=rate_limit, burst=burst)
 
-        self.client = hvac.Client(url=self.addr, token=self.token)
+        self.kv2_mount = kv2_mount.strip("/")
+        self.versions = None
+        self._versions_lock = threading.Lock()
+        # get_secrets saves the state once, after all of its reads
+        self._defer_save = False
+        if kv2_state:
+            self.versions = VersionState(kv2_state, state_secret or self.token)
         logger.debug("VaultProvider initialized")
 
+    def _read(self, path: str) -> dict:
+        if self.bucket:
+            self.bucket.acquire()
+        if self.router:
+            return self.router.read(path)
+        return self.client.read(path)
+
+    def _fetch(self, path: str) -> dict:
+        if self.jitter:
+            time.sleep(random.uniform(0, self.jitter))
+            self.jitter = 0.0
+        if not self.flight:
+            return self._read(path)
+        # never hand a response to a process, that holds another token
+        token_hash = hashlib.sha256((self.token or "").encode()).hexdigest()
+        return self.flight.fetch(
+            ("VaultProvider", self.addr, token_hash, path), lambda: self._read(path)
+        )
+
+    def _kv2_path(self, path: str, kind: str) -> str:
+        prefix = self.kv2_mount + "/"
+        if not path.startswith(prefix):
+            raise ProviderError(
+                "{} is not below the KV v2 mount {}".format(path, self.kv2_mount)
+            )
+        return "{}{}/{}".format(prefix, kind, path[len(prefix) :])
+
+    def _fetch_versioned(self, path: str) -> dict:
+        """
+        Read the metadata of a KV v2 secret and its data only, when its
+        version is newer than the one in the state file.
+        """
+        metadata = self._fetch(self._kv2_path(path, "metadata"))
+        version = metadata["data"]["current_version"]
+        with self._versions_lock:
+            data = self.versions.lookup(path, version)
+        if data is None:
+            response = self._fetch(self._kv2_path(path, "data"))["data"]
+            data = response["data"]
+            with self._versions_lock:
+                self.versions.store(path, response["metadata"]["version"], data)
+                # reads through get_source and the renewal thread count, too
+                if not self._defer_save:
+                    self.versions.save(prune=False)
+        return {"data": data}
+
+    def _refetch(self, path: str) -> dict:
+        if self.versions:
+            response = self._fetch_versioned(path)
+        else:
+            response = self._fetch(path)
+        previous = self.cache.get(path)
+        if previous is not None and previous != response["data"]:
+            self._changed = True
+        self.cache[path] = response["data"]
+        return response
+
+    def _start_renewal(self):
+        lookup_self, _ = token_methods(self.client)
+        token = lookup_self()["data"]
+        self.scheduler.track_token(token.get("ttl", 0), token.get("renewable", False))
+        self.scheduler.start()
+
+    def sources(self) -> list:
+        return self.paths
+
+    def get_source(self, path: str) -> dict:
+        if self.scheduler and not self.scheduler.running:
+            self._start_renewal()
+
+        if path not in self.cache:
+            response = self._refetch(path)
+            if self.scheduler:
+                self.scheduler.track_response(path, response)
+
+        data = {
+            key: Base64Blob(value) if key in self.blobs else value
+            for key, value in self.cache[path].items()
+        }
+        if not self.scheduler:
+            del self.cache[path]
+        logger.info("provided secrets from {}".format(path))
+        return data
+
     def get_secrets(self):
         """
         Fetch all the leaves from vaults KV tree and return a generator with
-        the values.
+        the values. Paths, that are not selected, are never read.
         """
+        self._changed = False
         secrets = {}
-        for path in self.paths:
-            secrets[path] = self.client.read(path)["data"]
-            logger.info("provided secrets from {}".format(path))
+        complete = False
+        self._defer_save = True
+        try:
+            for path in self.paths:
+                if self.selection.wants(path):
+                    secrets[path] = self.selection.project(path, self.get_source(path))
+            complete = True
+        finally:
+            self._defer_save = False
+            if self.versions:
+                # only a complete, unselected read knows all paths still exist
+                with self._versions_lock:
+                    self.versions.save(prune=complete and not self.selection)
         return secrets
 
+    def changed(self) -> bool:
+        """
+        Leases renewed in the background refetch their paths, this tells
+        whether one of them came back with different values.
+        """
+        return self._changed
+
+    def close(self):
+        """
+        Stop the background renewal, if there is any.
+        """
+        if self.scheduler:
+            self.scheduler.stop()
+
+
+class FileProvider(Provider):
+    """
+    Base class for Providers, that read their secrets from files in
+    `./assets`. With a `cache` file configured, only new or changed files are
+    decrypted, all others are served from the encrypted `DecryptCache`.
 
-class OpenSSLProvider(Provider):
+    Files ending with `blob_suffix` hold a single binary secret, named like
+    the file without that suffix. They are provided as a `Blob` and only
+    decrypted while a Consumer writes them.
+    """
+
+    pattern = None
+    blob_suffix = None
+    _stats = None
+
+    def _init_cache(self, cache: str, secret: str):
+        self.cache = DecryptCache(cache, secret) if cache else None
+
+    def read_file(self, filename: str) -> dict:
+        raise NotImplementedError
+
+    def read_blob(self, filename: str) -> Blob:
+        raise NotImplementedError
+
+    def sources(self) -> list:
+        return glob.glob(self.pattern)
+
+    def _read(self, filename: str) -> dict:
+        if filename.endswith(self.blob_suffix):
+            key = os.path.basename(filename)[: -len(self.blob_suffix)]
+            logger.info("provided blob from {}".format(filename))
+            return {key: self.read_blob(filename)}
+
+        data = self.cache.lookup(filename) if self.cache else None
+        if data is None:
+            data = self.read_file(filename)
+            if self.cache:
+                self.cache.store(filename, data)
+        logger.info("provided secrets from {}".format(filename))
+        return data
+
+    def get_source(self, filename: str) -> dict:
+        data = self._read(filename)
+        if self.cache:
+            self.cache.save(prune=False)
+        return data
+
+    def _stat_sources(self) -> dict:
+        return {
+            filename: stat_key(filename)
+            for filename in self.sources()
+            if self.selection.wants(filename)
+        }
+
+    def changed(self) -> bool:
+        """
+        The selected files differ from the last `get_secrets`, when a file was
+        added, removed or its (inode, size, mtime) changed.
+
+        >>> import shutil
+        >>> os.makedirs('tests/new.changed', exist_ok=True)
+        >>> _ = shutil.copy('./assets/secrets.plain', 'tests/new.changed/')
+        >>> provider = PlainTextProvider()
+        >>> provider.pattern = 'tests/new.changed/*.plain'
+        >>> provider.changed()
+        False
+        >>> _ = provider.get_secrets()
+        >>> provider.changed()
+        False
+        >>> os.utime('tests/new.changed/secrets.plain', ns=(0, 0))
+        >>> provider.changed()
+        True
+        """
+        return self._stats is not None and self._stats != self._stat_sources()
+
+    def get_secrets(self):
+        self._stats = self._stat_sources()
+        secrets = {}
+        for filename in self.sources():
+            if self.selection.wants(filename):
+                secrets[filename] = self.selection.project(
+                    filename, self._read(filename)
+                )
+
+        if self.cache:
+            self.cache.save(prune=not self.selection)
+        return secrets
+
+
+class OpenSSLProvider(FileProvider):
     """
     Decrypt and provide secrets from a static file encrypted symmetrically with
     OpenSSL.
 
     >>> OpenSSLProvider(secret='abc').get_secrets()
     {'./assets/test.enc': {'K1': 'V1', 'K2': 'V2'}}
+
+    Decrypted files can be cached between runs:
+    >>> OpenSSLProvider(secret='abc', cache='tests/new.enc.cache').get_secrets()
+    {'./assets/test.enc': {'K1': 'V1', 'K2': 'V2'}}
+    >>> OpenSSLProvider(secret='abc', cache='tests/new.enc.cache').get_secrets()
+    {'./assets/test.enc': {'K1': 'V1', 'K2': 'V2'}}
     """
 
-    def __init__(self, secret: str, cipher: str = "aes-256-cbc", md: str = "sha256"):
+    pattern = "./assets/*.enc"
+    blob_suffix = ".blob.enc"
+
+    def __init__(
+        self,
+        secret: str,
+        cipher: str = "aes-256-cbc",
+        md: str = "sha256",
+        cache: str = None,
+    ):
         self.secret = secret
         self.cipher = cipher
         self.md = md
@@ -70,46 +454,49 @@ class OpenSSLProvider(Provider):
             stderr=PIPE,
             stdout=PIPE,
         )
+        self._init_cache(cache, secret)
         logger.debug("OpenSSLProvider initialized")
 
-    def get_secrets(self):
+    def _command(self, filename: str) -> list:
+        return [
+            "openssl",
+            self.cipher,
+            "-d",
+            "-a",
+            "-md",
+            self.md,
+            "-in",
+            filename,
+            "-k",
+            self.secret,
+        ]
+
+    def read_file(self, filename: str) -> dict:
         """
         This implementation uses a preexisting openssl from the host system to
         run a command equivalent to:
         `openssl aes-256-cbc -md sha256 -d -a -in <symmetrically-encrypted.enc>`
 
         """
-        secrets = {}
-        for filename in glob.glob("./assets/*.enc"):
-            out = run_process(
-                [
-                    "openssl",
-                    self.cipher,
-                    "-d",
-                    "-a",
-                    "-md",
-                    self.md,
-                    "-in",
-                    filename,
-                    "-k",
-                    self.secret,
-                ],
-                self.popen_kwargs,
-            )
+        return env2dict(run_process(self._command(filename), self.popen_kwargs))
 
-            secrets[filename] = env2dict(out)
-            logger.info("provided secrets from {}".format(filename))
-            return secrets
+    def read_blob(self, filename: str) -> Blob:
+        return ProcessBlob(
+            self._command(filename), executable=self.popen_kwargs["executable"]
+        )
 
 
-class GPGProvider(Provider):
+class GPGProvider(FileProvider):
     """
     Decrypt and provide secrets from a static gpg file encrypted symmetrically.
     >>> GPGProvider(secret='abc').get_secrets()
     {'./assets/test.gpg': {'K1': 'V1', 'K2': 'V2'}}
     """
 
-    def __init__(self, secret: str):  # nosec
+    pattern = "./assets/*.gpg"
+    blob_suffix = ".blob.gpg"
+
+    def __init__(self, secret: str, cache: str = None):  # nosec
         self.secret = secret
         self.popen_kwargs = dict(
             bufsize=-1,
@@ -119,47 +506,228 @@ class GPGProvider(Provider):
             stderr=PIPE,
             stdout=PIPE,
         )
+        self._init_cache(cache, secret)
         logger.debug("GPGProvider initialised")
 
-    def get_secrets(self):
+    def _command(self, filename: str) -> list:
+        return [
+            "gpg",
+            "-qd",
+            "--yes",
+            "--batch",
+            "--passphrase={}".format(self.secret),
+            filename,
+        ]
+
+    def read_file(self, filename: str) -> dict:
         """
         This implementation uses a preexisting gpg binary from the host system
         to run a command equivalent to `gpg -qd <symmetrically-encypted.gpg>`
         """
-        secrets = {}
-        for filename in glob.glob("./assets/*.gpg"):
-            out = run_process(
-                [
-                    "gpg",
-                    "-qd",
-                    "--yes",
-                    "--batch",
-                    "--passphrase={}".format(self.secret),
-                    filename,
-                ],
-                self.popen_kwargs,
-            )
-            secrets[filename] = env2dict(out)
-            logger.info("provided secrets from {}".format(filename))
+        return env2dict(run_process(self._command(filename), self.popen_kwargs))
 
-        return secrets
+    def read_blob(self, filename: str) -> Blob:
+        return ProcessBlob(
+            self._command(filename), executable=self.popen_kwargs["executable"]
+        )
 
 
-class PlainTextProvider(Provider):
+class PlainTextProvider(FileProvider):
     """
     >>> PlainTextProvider().get_secrets()
     {'./assets/secrets.plain': {'K1': 'V1', 'K2': 'V2'}}
+
+    Plain files carry no secret of their own, so the cache needs one:
+    >>> PlainTextProvider(cache='tests/new.plain.cache', cache_secret='abc').get_secrets()
+    {'./assets/secrets.plain': {'K1': 'V1', 'K2': 'V2'}}
     """
 
-    def __init__(self):
-        logger.debug("GPGProvider initialised")
+    pattern = "./assets/*.plain"
+    blob_suffix = ".blob.plain"
+
+    def __init__(self, cache: str = None, cache_secret: str = None):
+        if cache and not cache_secret:
+            raise ProviderError("PlainTextProvider needs a cache_secret to cache")
+        self._init_cache(cache, cache_secret)
+        logger.debug("PlainTextProvider initialised")
+
+    def read_file(self, filename: str) -> dict:
+        with open(filename, "r") as infile:
+            return env2dict(infile.read())
+
+    def read_blob(self, filename: str) -> Blob:
+        return FileBlob(filename)
+
+
+class TransitProvider(FileProvider):
+    """
+    Decrypt and provide secrets from files of vault transit ciphertexts, like
+    `KEY=vault:v1:...`, with the transit key `key`. The values of all files,
+    that are not served from the `cache`, are decrypted together in chunks of
+    `chunk_size` with the `batch_input` of the `decrypt` endpoint, running up
+    to `workers` chunks at once. Decryption is a write, so it always goes to
+    the active node of `addr`.
+
+    >>> from tests.fakevault import FakeVault, fake_decrypt, fake_encrypt
+    >>> vault = FakeVault().start()
+    >>> vault.handlers["transit/decrypt/app"] = fake_decrypt
+    >>> provider = TransitProvider(key="app", token="t", addr=vault.addr)
+    >>> provider.get_secrets()
+    {'./assets/test.transit': {'K1': 'V1', 'K2': 'V2'}}
+
+    Thousands of values take only a few round trips:
+    >>> del vault.requests[:]
+    >>> values = ["value-{}".format(index) for index in range(2000)]
+    >>> provider.decrypt([fake_encrypt(value) for value in values]) == values
+    True
+    >>> len(vault.requests)
+    8
+
+    Many files are decrypted in one batch, too:
+    >>> os.makedirs("tests/new.transit", exist_ok=True)
+    >>> for name in ("a", "b", "c"):
+    ...     with open("tests/new.transit/{}.transit".format(name), "w") as out:
+    ...         _ = out.write("KEY_{}={}\\n".format(name.upper(), fake_encrypt(name)))
+    >>> with open("tests/new.transit/cert.pem.blob.transit", "w") as out:
+    ...     _ = out.write(fake_encrypt("binary"))
+    >>> provider.pattern = "tests/new.transit/*.transit"
+    >>> del vault.requests[:]
+    >>> secrets = provider.get_secrets()
+    >>> sorted((key, value) for data in secrets.values() for key, value in data.items()
+    ...        if isinstance(value, str))
+    [('KEY_A', 'a'), ('KEY_B', 'b'), ('KEY_C', 'c')]
+    >>> len(vault.requests)
+    1
+    >>> vault.stop()
+    """
+
+    pattern = "./assets/*.transit"
+    blob_suffix = ".blob.transit"
+
+    def __init__(
+        self,
+        key: str,
+        token: str = os.environ.get("VAULTIFY_SECRET"),
+        addr: str = None,
+        mount: str = "transit",
+        chunk_size: int = 250,
+        workers: int = 4,
+        cache: str = None,
+        cache_secret: str = None,
+    ):
+        if cache and not cache_secret:
+            raise ProviderError("TransitProvider needs a cache_secret to cache")
+        self.token = os.environ.get("VAULT_TOKEN", token)
+        self.addr = os.environ.get("VAULT_ADDR", addr)
+        nodes = parse_nodes(self.addr) if self.addr else []
+        active = [node for node, role in nodes if role == "active"] or [
+            node for node, _ in nodes
+        ]
+        self.client = vault_client(active[0] if active else None, self.token)
+        self.path = "{}/decrypt/{}".format(mount.strip("/"), key)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._init_cache(cache, cache_secret)
+        logger.debug("TransitProvider initialized")
+
+    def _decrypt_chunk(self, ciphertexts: list) -> list:
+        response = self.client.write(
+            self.path, batch_input=[{"ciphertext": value} for value in ciphertexts]
+        )
+        results = response["data"]["batch_results"]
+        errors = [result["error"] for result in results if result.get("error")]
+        if errors:
+            raise ProviderError(
+                "transit could not decrypt {} values: {}".format(len(errors), errors[0])
+            )
+        return [result["plaintext"] for result in results]
+
+    def decrypt_base64(self, ciphertexts: list) -> list:
+        """
+        Return the base64 encoded plaintexts of `ciphertexts`, in order.
+        """
+        chunks = [
+            ciphertexts[start : start + self.chunk_size]
+            for start in range(0, len(ciphertexts), self.chunk_size)
+        ]
+        if len(chunks) < 2:
+            return [value for chunk in chunks for value in self._decrypt_chunk(chunk)]
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+            return [
+                value
+                for plaintexts in pool.map(self._decrypt_chunk, chunks)
+                for value in plaintexts
+            ]
+
+    def decrypt(self, ciphertexts: list) -> list:
+        return [
+            base64.b64decode(value).decode("utf-8")
+            for value in self.decrypt_base64(ciphertexts)
+        ]
+
+    def _ciphertexts(self, filename: str) -> dict:
+        with open(filename, "r") as infile:
+            if filename.endswith(self.blob_suffix):
+                key = os.path.basename(filename)[: -len(self.blob_suffix)]
+                return {key: infile.read().strip()}
+            return env2dict(infile.read())
+
+    def read_file(self, filename: str) -> dict:
+        ciphertexts = self._ciphertexts(filename)
+        return dict(zip(ciphertexts, self.decrypt(list(ciphertexts.values()))))
+
+    def read_blob(self, filename: str) -> Blob:
+        [(key, ciphertext)] = self._ciphertexts(filename).items()
+        return Base64Blob(self.decrypt_base64([ciphertext])[0])
 
     def get_secrets(self):
+        """
+        Decrypt the values of all selected files, that are not cached, in one
+        batch and split the plaintexts back per file.
+        """
+        self._stats = self._stat_sources()
+        filenames = [name for name in self.sources() if self.selection.wants(name)]
+
+        data = {}
+        pending = {}
+        for filename in filenames:
+            cached = None
+            if self.cache and not filename.endswith(self.blob_suffix):
+                cached = self.cache.lookup(filename)
+            if cached is None:
+                pending[filename] = self._ciphertexts(filename)
+            else:
+                data[filename] = cached
+
+        plaintexts = iter(
+            self.decrypt_base64(
+                [
+                    value
+                    for ciphertexts in pending.values()
+                    for value in ciphertexts.values()
+                ]
+            )
+        )
+        for filename, ciphertexts in pending.items():
+            values = {key: next(plaintexts) for key in ciphertexts}
+            if filename.endswith(self.blob_suffix):
+                data[filename] = {
+                    key: Base64Blob(value) for key, value in values.items()
+                }
+                continue
+            data[filename] = {
+                key: base64.b64decode(value).decode("utf-8")
+                for key, value in values.items()
+            }
+            if self.cache:
+                self.cache.store(filename, data[filename])
+
         secrets = {}
-        for filename in glob.glob("./assets/*.plain"):
-            with open(filename, "r") as infile:
-                out = infile.read()
-                secrets[filename] = env2dict(out)
+        for filename in filenames:
             logger.info("provided secrets from {}".format(filename))
+            secrets[filename] = self.selection.project(filename, data[filename])
 
+        if self.cache:
+            self.cache.save(prune=not self.selection)
         return secrets
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements the background renewal of vault tokens and secret leases.
+"""
+
+import heapq
+import logging
+import threading
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("RenewalScheduler", "token_methods")
+
+TOKEN = "token"
+LEASE = "lease"
+
+
+def token_methods(client):
+    """
+    Return the (lookup_self, renew_self) methods of the clients own token.
+    Releases of hvac before 0.9 only have them on the client itself.
+    """
+    token = getattr(getattr(client, "auth", None), "token", None)
+    if token is not None and hasattr(token, "renew_self"):
+        return token.lookup_self, token.renew_self
+    return client.lookup_token, client.renew_token
+
+
+class RenewalScheduler:
+    """
+    Track the TTL of a vault token and of all secret leases read with it and
+    renew each of them after a fraction of its TTL has passed. All renewals
+    share one timer thread. When a lease can not be renewed anymore, only the
+    path it belongs to is handed to `refetch`, which must return the fresh
+    vault response for that path. A failed token renewal or refetch is tried
+    again after `min_interval` seconds, doubling up to `max_backoff`.
+
+    >>> import hvac
+    >>> from tests.fakevault import FakeVault
+    >>> vault = FakeVault().start()
+    >>> vault.handlers["auth/token/renew-self"] = lambda method, body: (
+    ...     200, {"auth": {"lease_duration": 60, "renewable": True}})
+    >>> vault.handlers["sys/leases/renew"] = lambda method, body: (
+    ...     (400, {"errors": ["lease expired"]}) if body["lease_id"] == "db/creds/1"
+    ...     else (200, {"lease_id": body["lease_id"], "lease_duration": body["increment"]}))
+
+    >>> refetch = lambda path: {
+    ...     "lease_id": "db/creds/2", "lease_duration": 30, "renewable": True}
+    >>> client = hvac.Client(url=vault.addr, token="t")
+    >>> rs = RenewalScheduler(client, refetch=refetch, fraction=0.5)
+    >>> rs.track_token(ttl=60, renewable=True, now=0)
+    >>> rs.track_lease("kv/app", "kv/app/1", ttl=10, renewable=True, now=0)
+    >>> rs.track_lease("db/creds", "db/creds/1", ttl=20, renewable=True, now=0)
+    >>> rs.track_lease("kv/static", "", ttl=0, renewable=False, now=0)
+    >>> rs.pending()
+    [(5.0, 'lease', 'kv/app'), (10.0, 'lease', 'db/creds'), (30.0, 'token', None)]
+
+    Only entries that are due get renewed, a failed renewal refetches its path:
+    >>> rs.run_pending(now=10)
+    2
+    >>> rs.pending()
+    [(15.0, 'lease', 'kv/app'), (25.0, 'lease', 'db/creds'), (30.0, 'token', None)]
+    >>> rs.leases["db/creds"]
+    'db/creds/2'
+
+    The token is renewed through its renew-self endpoint:
+    >>> token_due = lambda: [due for due, kind, _ in rs.pending() if kind == "token"]
+    >>> _ = rs.run_pending(now=30)
+    >>> token_due()
+    [60.0]
+
+    A failed token renewal is retried with a growing delay:
+    >>> vault.handlers["auth/token/renew-self"] = lambda method, body: (
+    ...     500, {"errors": ["vault is busy"]})
+    >>> _ = rs.run_pending(now=60)
+    >>> token_due()
+    [61.0]
+    >>> _ = rs.run_pending(now=61)
+    >>> token_due()
+    [63.0]
+    >>> vault.stop()
+    """
+
+    def __init__(
+        self,
+        client,
+        refetch: t.Callable[[str], dict],
+        fraction: float = 0.66,
+        min_interval: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        if not 0 < fraction < 1:
+            raise ValueError("fraction must be between 0 and 1: {}".format(fraction))
+
+        self.client = client
+        self.refetch = refetch
+        self.fraction = fraction
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.leases = {}
+        self._failures = {}
+        self._ttls = {}
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _schedule(self, kind: str, path: t.Optional[str], ttl: int, now: float):
+        self._failures.pop((kind, path), None)
+        self._push(now + max(ttl * self.fraction, self.min_interval), kind, path)
+
+    def _retry(self, kind: str, path: t.Optional[str], now: float):
+        failures = self._failures.get((kind, path), 0)
+        self._failures[(kind, path)] = failures + 1
+        delay = min(self.min_interval * 2 ** failures, self.max_backoff)
+        logger.info("retrying the {} of {} in {}s".format(kind, path, delay))
+        self._push(now + delay, kind, path)
+
+    def _push(self, due: float, kind: str, path: t.Optional[str]):
+        with self._lock:
+            self._queue = [
+                entry for entry in self._queue if (entry[1], entry[2]) != (kind, path)
+            ]
+            heapq.heapify(self._queue)
+            heapq.heappush(self._queue, (due, kind, path))
+        self._wakeup.set()
+
+    def pending(self) -> list:
+        with self._lock:
+            return sorted(self._queue, key=lambda entry: entry[0])
+
+    def track_token(self, ttl: int, renewable: bool, now: float = None):
+        """
+        Start tracking the clients token. Tokens without a TTL never expire.
+        """
+        if not ttl or not renewable:
+            logger.debug("token is not renewable, ttl {}".format(ttl))
+            return
+        self._ttls[(TOKEN, None)] = ttl
+        self._schedule(TOKEN, None, ttl, time.monotonic() if now is None else now)
+
+    def track_lease(
+        self, path: str, lease_id: str, ttl: int, renewable: bool, now: float = None
+    ):
+        """
+        Start tracking the lease of `path`. Non-expiring secrets, like the
+        ones from the KV engine, are ignored.
+        """
+        if not ttl:
+            logger.debug("{} carries no lease".format(path))
+            return
+
+        now = time.monotonic() if now is None else now
+        self.leases[path] = lease_id
+        # a lease without renewal is refetched once it is due
+        self._ttls[(LEASE, path)] = ttl if renewable and lease_id else 0
+        self._schedule(LEASE, path, ttl, now)
+
+    def track_response(self, path: str, response: dict, now: float = None):
+        """
+        Track the lease of a raw vault response for `path`.
+        """
+        self.track_lease(
+            path,
+            response.get("lease_id", ""),
+            response.get("lease_duration", 0),
+            response.get("renewable", False),
+            now=now,
+        )
+
+    def _renew_token(self, now: float):
+        ttl = self._ttls[(TOKEN, None)]
+        _, renew_self = token_methods(self.client)
+        try:
+            auth = renew_self(increment=ttl)["auth"]
+        except Exception as error:
+            logger.critical("could not renew the vault token: {}".format(error))
+            self._retry(TOKEN, None, now)
+            return
+        logger.info("renewed the vault token")
+        self.track_token(auth["lease_duration"], auth.get("renewable", True), now)
+
+    def _renew_lease(self, path: str, now: float):
+        ttl = self._ttls.get((LEASE, path))
+        if ttl:
+            try:
+                response = self.client.sys.renew_lease(
+                    lease_id=self.leases[path], increment=ttl
+                )
+            except Exception as error:
+                logger.warning("could not renew lease for {}: {}".format(path, error))
+            else:
+                if response.get("lease_duration", 0) >= ttl * (1 - self.fraction):
+                    logger.info("renewed lease for {}".format(path))
+                    self.track_response(path, dict(response, renewable=True), now=now)
+                    return
+                logger.info("lease for {} reached its max ttl".format(path))
+
+        logger.info("refetching {}".format(path))
+        try:
+            self.track_response(path, self.refetch(path), now=now)
+        except Exception as error:
+            logger.critical("could not refetch {}: {}".format(path, error))
+            self._retry(LEASE, path, now)
+
+    def run_pending(self, now: float = None) -> int:
+        """
+        Renew everything that is due and return how many entries were handled.
+        """
+        now = time.monotonic() if now is None else now
+        handled = 0
+        while True:
+            with self._lock:
+                if not self._queue or self._queue[0][0] > now:
+                    break
+                _, kind, path = heapq.heappop(self._queue)
+            if kind == TOKEN:
+                self._renew_token(now)
+            else:
+                self._renew_lease(path, now)
+            handled += 1
+        return handled
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self.run_pending()
+            with self._lock:
+                timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """
+        Start the timer thread. A stopped scheduler can be started again.
+
+        >>> rs = RenewalScheduler(client=None, refetch=None)
+        >>> rs.start(); rs.stop(); rs.start()
+        >>> rs.running, rs._thread.is_alive()
+        (True, True)
+        >>> rs.stop()
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._loop, name="vaultify-renewal", daemon=True
+            )
+            self._thread.start()
+            logger.debug("renewal scheduler started")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        logger.debug("renewal scheduler stopped")
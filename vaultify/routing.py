@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements routing vault reads across several vault nodes.
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+import typing as t
+
+import hvac
+import requests
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("Node", "ReadRouter", "parse_nodes")
+
+ROLES = ("active", "standby", "replica")
+
+# errors, after which another node may well succeed
+FAILOVER_ERRORS = (
+    requests.exceptions.RequestException,
+    hvac.exceptions.VaultDown,
+    hvac.exceptions.InternalServerError,
+    hvac.exceptions.RateLimitExceeded,
+    hvac.exceptions.UnexpectedError,
+)
+
+
+def parse_nodes(addrs: t.Union[str, list]) -> t.List[t.Tuple[str, str]]:
+    """
+    Parse a comma separated list of vault addresses with optional role hints.
+
+    >>> parse_nodes("https://a:8200=active,https://b:8200=standby,https://c:8200")
+    [('https://a:8200', 'active'), ('https://b:8200', 'standby'), ('https://c:8200', 'replica')]
+    >>> parse_nodes("https://a:8200")
+    [('https://a:8200', 'active')]
+    >>> parse_nodes("https://a:8200=leader")
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown vault node role: leader
+    """
+    if isinstance(addrs, str):
+        addrs = addrs.split(",")
+
+    nodes = []
+    for index, addr in enumerate(filter(None, addrs)):
+        addr, _, role = addr.strip().partition("=")
+        role = role or ("active" if index == 0 else "replica")
+        if role not in ROLES:
+            raise ValueError("unknown vault node role: {}".format(role))
+        nodes.append((addr, role))
+    return nodes
+
+
+class Node:
+    def __init__(
+        self,
+        addr: str,
+        role: str,
+        client: hvac.Client,
+        probe_client: hvac.Client = None,
+    ):
+        self.addr = addr
+        self.role = role
+        self.client = client
+        # health checks give up sooner than reads
+        self.probe_client = probe_client or client
+        self.latency = None
+        self.down_until = 0.0
+
+    def __repr__(self):
+        return "<Node {} {}>".format(self.addr, self.role)
+
+    def healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+
+class ReadRouter:
+    """
+    Route reads to the healthy vault node with the lowest latency. Every node
+    keeps its own client and with that its own connection pool. The latency
+    of a node is a moving average over its reads and over health checks of
+    all nodes, which run every `probe_interval` seconds in the background, so
+    that the estimates of nodes, that are not read from, keep moving, too. A
+    node, that fails, is skipped for `cooldown` seconds, or until it passes a
+    health check, and the read moves on to the next one. Health checks of all
+    nodes run at once and give up after `probe_timeout` seconds, so a node,
+    that does not answer, holds up the first read only that long.
+
+    >>> from tests.fakevault import FakeVault
+    >>> secrets = {"secret/app": {"K1": "V1"}}
+    >>> slow = FakeVault(secrets, delay=0.05).start()
+    >>> fast = FakeVault(secrets).start()
+    >>> sealed = FakeVault(secrets, sealed=True).start()
+    >>> router = ReadRouter(
+    ...     [(slow.addr, "active"), (sealed.addr, "standby"), (fast.addr, "replica")],
+    ...     token="t",
+    ... )
+
+    The sealed node is found unhealthy and the fast one is preferred:
+    >>> router.read("secret/app")["data"]
+    {'K1': 'V1'}
+    >>> len(fast.requests), len(slow.requests), len(sealed.requests)
+    (1, 0, 0)
+
+    When the preferred node goes down, reads fail over:
+    >>> fast.stop()
+    >>> router.read("secret/app")["data"]
+    {'K1': 'V1'}
+    >>> len(slow.requests)
+    1
+    >>> router.primary.role
+    'active'
+    >>> slow.stop(); sealed.stop()
+
+    A node, that gets faster, is found by the periodic health checks:
+    >>> first = FakeVault(secrets, delay=0.05).start()
+    >>> second = FakeVault(secrets, delay=0.02).start()
+    >>> router = ReadRouter(
+    ...     [(first.addr, "active"), (second.addr, "replica")],
+    ...     token="t",
+    ...     probe_interval=0.01,
+    ... )
+    >>> router.read("secret/app")["data"]
+    {'K1': 'V1'}
+    >>> router.candidates()[0].addr == second.addr
+    True
+    >>> first.delay = 0
+    >>> for _ in range(200):
+    ...     _ = router.read("secret/app")
+    ...     if router.candidates()[0].addr == first.addr:
+    ...         break
+    ...     time.sleep(0.02)
+    >>> router.candidates()[0].addr == first.addr
+    True
+    >>> first.stop(); second.stop()
+
+    A node, that accepts connections but never answers, is skipped quickly:
+    >>> import socket
+    >>> blackhole = socket.socket()
+    >>> blackhole.bind(("127.0.0.1", 0)); blackhole.listen()
+    >>> fast = FakeVault(secrets).start()
+    >>> router = ReadRouter(
+    ...     [("http://127.0.0.1:{}".format(blackhole.getsockname()[1]), "active"),
+    ...      (fast.addr, "replica")],
+    ...     token="t",
+    ...     probe_timeout=0.2,
+    ... )
+    >>> started = time.monotonic()
+    >>> router.read("secret/app")["data"], time.monotonic() - started < 1
+    ({'K1': 'V1'}, True)
+    >>> fast.stop(); blackhole.close()
+    """
+
+    def __init__(
+        self,
+        nodes: t.List[t.Tuple[str, str]],
+        token: str,
+        alpha: float = 0.3,
+        cooldown: float = 30.0,
+        probe_interval: float = 30.0,
+        probe_timeout: float = 2.0,
+    ):
+        from .providers import vault_client
+
+        self.nodes = [
+            Node(
+                addr,
+                role,
+                vault_client(addr, token),
+                hvac.Client(url=addr, token=token, timeout=probe_timeout),
+            )
+            for addr, role in nodes
+        ]
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._probed_at = None
+        self._probing = False
+
+    @property
+    def primary(self) -> Node:
+        """
+        The node for everything, that is not a read, like token renewals.
+        """
+        for node in self.nodes:
+            if node.role == "active":
+                return node
+        return self.nodes[0]
+
+    def _record(self, node: Node, latency: float):
+        with self._lock:
+            if node.latency is None:
+                node.latency = latency
+            else:
+                node.latency = self.alpha * latency + (1 - self.alpha) * node.latency
+
+    def _fail(self, node: Node, error: Exception):
+        logger.warning("vault node {} failed: {}".format(node.addr, error))
+        with self._lock:
+            node.down_until = time.monotonic() + self.cooldown
+
+    def _check(self, node: Node):
+        started = time.monotonic()
+        try:
+            node.probe_client.read("sys/health?standbyok=true&perfstandbyok=true")
+        except FAILOVER_ERRORS as error:
+            self._fail(node, error)
+        else:
+            self._record(node, time.monotonic() - started)
+            with self._lock:
+                node.down_until = 0.0
+
+    def probe(self):
+        """
+        Measure the latency of every node with a health check, all at once.
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.nodes), thread_name_prefix="vaultify-probe"
+        ) as executor:
+            list(executor.map(self._check, self.nodes))
+        self._probed_at = time.monotonic()
+
+    def _reprobe(self):
+        try:
+            self.probe()
+        finally:
+            self._probing = False
+
+    def _maybe_probe(self):
+        """
+        Probe all nodes before the first read, and then every
+        `probe_interval` seconds in a background thread.
+        """
+        if self._probed_at is None:
+            self.probe()
+            return
+        with self._lock:
+            if (
+                self._probing
+                or time.monotonic() - self._probed_at < self.probe_interval
+            ):
+                return
+            self._probing = True
+        threading.Thread(
+            target=self._reprobe, name="vaultify-probe", daemon=True
+        ).start()
+
+    def candidates(self) -> t.List[Node]:
+        """
+        All nodes, the healthy ones first and ordered by latency, then role.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return sorted(
+                self.nodes,
+                key=lambda node: (
+                    not node.healthy(now),
+                    float("inf") if node.latency is None else node.latency,
+                    ROLES.index(node.role),
+                ),
+            )
+
+    def read(self, path: str) -> dict:
+        self._maybe_probe()
+
+        error = None
+        for node in self.candidates():
+            started = time.monotonic()
+            try:
+                response = node.client.read(path)
+            except FAILOVER_ERRORS as failure:
+                self._fail(node, failure)
+                error = failure
+                continue
+            self._record(node, time.monotonic() - started)
+            logger.debug("read {} from {}".format(path, node.addr))
+            return response
+        raise error
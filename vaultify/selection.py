@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This file implements the selection of keys from the sources of a Provider.
+"""
+
+import collections.abc
+import fnmatch
+import logging
+import threading
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+__all__ = ("Selection", "LazySecrets")
+
+GLOB_CHARS = set("*?[")
+
+
+class Selection:
+    """
+    A Selection names the sources (vault paths, asset files) to use and per
+    source the keys to `include`, `exclude` and `rename`. Source names and
+    key patterns may contain shell wildcards. Without a spec, everything is
+    selected.
+
+    >>> sel = Selection({
+    ...     "secret/app": {"include": ["DB_*"], "rename": {"DB_PASS": "PGPASSWORD"}},
+    ...     "./assets/*.gpg": {"exclude": ["DEBUG"]},
+    ... })
+    >>> sel.wants("secret/app"), sel.wants("./assets/x.gpg"), sel.wants("secret/other")
+    (True, True, False)
+    >>> sel.project("secret/app", {"DB_USER": "u", "DB_PASS": "p", "API": "a"})
+    {'DB_USER': 'u', 'PGPASSWORD': 'p'}
+    >>> sel.project("./assets/x.gpg", {"K1": "V1", "DEBUG": "1"})
+    {'K1': 'V1'}
+    >>> Selection().project("anything", {"K1": "V1"})
+    {'K1': 'V1'}
+    """
+
+    def __init__(self, spec: dict = None):
+        self.spec = spec or {}
+
+    def __bool__(self):
+        return bool(self.spec)
+
+    def rules(self, source: str) -> t.Optional[dict]:
+        if source in self.spec:
+            return self.spec[source] or {}
+        for pattern, rules in self.spec.items():
+            if fnmatch.fnmatchcase(source, pattern):
+                return rules or {}
+        return None
+
+    def wants(self, source: str) -> bool:
+        return not self.spec or self.rules(source) is not None
+
+    def project(self, source: str, data: dict) -> dict:
+        rules = self.rules(source) or {}
+        include = rules.get("include")
+        exclude = rules.get("exclude", [])
+        rename = rules.get("rename", {})
+
+        projected = {}
+        for key, value in data.items():
+            if include is not None and not any(
+                fnmatch.fnmatchcase(key, pattern) for pattern in include
+            ):
+                continue
+            if any(fnmatch.fnmatchcase(key, pattern) for pattern in exclude):
+                continue
+            projected[rename.get(key, key)] = value
+        return projected
+
+    def declared_keys(self, source: str) -> t.Optional[list]:
+        """
+        Return the final names of all keys `source` provides, if they are
+        known without fetching it.
+
+        >>> Selection({"a": {"include": ["K1", "K2"], "rename": {"K2": "X"}}}).declared_keys("a")
+        ['K1', 'X']
+        >>> Selection({"a": {"include": ["K*"]}}).declared_keys("a")
+        """
+        include = (self.rules(source) or {}).get("include")
+        if include is None or any(GLOB_CHARS & set(key) for key in include):
+            return None
+        rename = self.rules(source).get("rename", {})
+        return [rename.get(key, key) for key in include]
+
+
+class LazySecrets(collections.abc.Mapping):
+    """
+    A read only mapping of the selected secrets of a Provider, which fetches
+    a source only when one of its keys is first accessed. Keys of sources
+    without an exact `include` list are only known after fetching, so these
+    sources are fetched one by one when an unknown key is looked up.
+
+    >>> from .providers import PlainTextProvider
+    >>> provider = PlainTextProvider()
+    >>> provider.push_down(Selection({"./assets/secrets.plain": {"include": ["K1"]}}))
+    >>> secrets = LazySecrets(provider)
+    >>> "K1" in secrets, secrets.fetched
+    (True, ['./assets/secrets.plain'])
+    >>> secrets["K1"], "K2" in secrets
+    ('V1', False)
+
+    Iterating fetches all sources, so that only keys, that exist, are listed:
+    >>> provider.push_down(
+    ...     Selection({"./assets/secrets.plain": {"include": ["K1", "MISSING"]}})
+    ... )
+    >>> secrets = LazySecrets(provider)
+    >>> list(secrets), len(secrets), dict(secrets)
+    (['K1'], 1, {'K1': 'V1'})
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.selection = provider.selection
+        self.fetched = []
+        self._values = {}
+        self._declared = {}
+        self._undeclared = []
+        self._lock = threading.RLock()
+
+        for source in provider.sources():
+            if not self.selection.wants(source):
+                continue
+            keys = self.selection.declared_keys(source)
+            if keys is None:
+                self._undeclared.append(source)
+            for key in keys or []:
+                self._declared.setdefault(key, source)
+
+    def _fetch(self, source: str):
+        logger.debug("lazily fetching {}".format(source))
+        self._values.update(
+            self.selection.project(source, self.provider.get_source(source))
+        )
+        self.fetched.append(source)
+        # declared keys, that the source does not have, do not exist
+        for key, declared_source in list(self._declared.items()):
+            if declared_source == source and key not in self._values:
+                del self._declared[key]
+
+    def __getitem__(self, key: str):
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+
+            source = self._declared.get(key)
+            if source is not None and source not in self.fetched:
+                self._fetch(source)
+            while key not in self._values and self._undeclared:
+                self._fetch(self._undeclared.pop(0))
+            return self._values[key]
+
+    def _keys(self) -> list:
+        with self._lock:
+            for source in list(dict.fromkeys(self._declared.values())):
+                if source not in self.fetched:
+                    self._fetch(source)
+            while self._undeclared:
+                self._fetch(self._undeclared.pop(0))
+            return list(self._values)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
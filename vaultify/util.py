@@ -4,28 +4,42 @@
 This contains some simple util functions used for digesting secrets by
 Vaultify
 """
+
 import os
 import re
 import typing as t
 import logging.config
 import yaml
 from subprocess import Popen
-
+from .blobs import Blob
 
 logger = logging.getLogger(__name__)
 
 
-def dict2env(secret_data: dict) -> t.Iterable:
+def shell_quote(value: t.Any) -> str:
+    """
+    Quote a value for a POSIX shell, single quotes included.
+
+    >>> print(shell_quote("it's"))
+    'it'"'"'s'
+    """
+    return "'{}'".format(str(value).replace("'", "'\"'\"'"))
+
+
+def dict2env(secret_data: dict) -> t.Iterator[str]:
     """
-    This function transforms a dictionary from a vaultify provider and returns
-    a list of shell viable lines `export K=v`
+    This function transforms a dictionary from a vaultify provider and yields
+    shell viable lines `export K='v'`
 
-    >>> dict2env({"KEY1": "VAL1", "KEY2": "VAL2"})
-    ["export KEY1='VAL1'", "export KEY2='VAL2'"]
+    >>> for line in dict2env({"KEY1": "VAL1", "KEY2": "it's"}):
+    ...     print(line)
+    export KEY1='VAL1'
+    export KEY2='it'"'"'s'
 
     """
     logger.debug("transforming this dict to newline separated K=V pairs")
-    return ["export {}='{}'".format(key, value) for key, value in secret_data.items()]
+    for key, value in secret_data.items():
+        yield "export {}={}".format(key, shell_quote(value))
 
 
 def env2dict(env_data: t.AnyStr) -> dict:
@@ -43,6 +57,8 @@ def env2dict(env_data: t.AnyStr) -> dict:
     {'KEY1': 'VAL1', 'KEY2': 'VAL2'}
     >>> env2dict('KEY1= #VAL1\\n#KEY2=VAL2')
     {'KEY1': ''}
+    >>> env2dict('KEY1=dmFsdWU=')
+    {'KEY1': 'dmFsdWU='}
     """
     logger.debug("transforming the env to dict-class")
 
@@ -51,7 +67,7 @@ def env2dict(env_data: t.AnyStr) -> dict:
     for line in line_data:
         line = re.sub("\s*#.*", "", line)
         if line:
-            key, value = line.split("=")
+            key, value = line.split("=", 1)
             dict_data[key] = value
     return dict_data
 
@@ -74,7 +90,7 @@ def mask_secrets(secrets: dict) -> dict:
     masked = {}
 
     for key, value in secrets.items():
-        if isinstance(value, (str, int)):
+        if isinstance(value, (str, int, Blob)):
             # being extra destructive here, since we do
             # never want secrets leaked into logs
             value = "***"
@@ -7,13 +7,18 @@ This file implements vaultifys main function
 
 import sys
 import logging
+import logging.config
 import typing as t
 
 from . import CFG
+from .config import CFG_DEFAULT_FILES, configure
 from .base import API, Consumer, Provider
 from .util import mask_secrets
+from .selection import LazySecrets, Selection
 from .exceptions import ProviderError, ConsumerError
-
+from .batch import run_batch
+from .cli import parse_args
+from .profiling import Profiler
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +50,13 @@ class Vaultify(API):
         logger.info("consuming secrets with {}".format(self._consumer))
         return self._consumer.consume_secrets(data)
 
+    def lazy_secrets(self) -> LazySecrets:
+        """
+        Return a mapping, which fetches each source of the Provider only when
+        one of its keys is first accessed.
+        """
+        return LazySecrets(self._provider)
+
     def validate(self) -> t.Iterable:
         """
         >>> vfy = Vaultify(
@@ -72,7 +84,7 @@ class Vaultify(API):
 
         return results
 
-    def run(self) -> bool:
+    def _merged_secrets(self) -> dict:
         secrets = self.get_secrets()
         if not secrets:
             raise ValueError(
@@ -83,7 +95,21 @@ class Vaultify(API):
         for data in secrets.values():
             logger.info("consuming secret: %s", mask_secrets(secrets))
             to_consumer.update(data)
+        return to_consumer
 
+    def refresh(self) -> t.Optional[dict]:
+        """
+        Return fresh secrets for the Consumer, when the Provider reports a
+        change, otherwise None.
+        """
+        if not self._provider.changed():
+            return None
+        logger.info("{} reported changed secrets".format(self._provider))
+        return self._merged_secrets()
+
+    def run(self) -> bool:
+        to_consumer = self._merged_secrets()
+        self._consumer.refresh = self.refresh
         return self.consume_secrets(to_consumer)
 
 
@@ -112,9 +138,11 @@ def factory(config_dict: dict, **kwargs) -> Vaultify:
     provider_class = getattr(providers, vfy["provider"]["class"])
     consumer_class = getattr(consumers, vfy["consumer"]["class"])
 
+    provider = provider_class(**vfy["provider"]["args"])
+    provider.push_down(Selection(vfy["provider"].get("select")))
+
     return Vaultify(
-        provider=provider_class(**vfy["provider"]["args"]),
-        consumer=consumer_class(**vfy["consumer"]["args"]),
+        provider=provider, consumer=consumer_class(**vfy["consumer"]["args"])
     )
 
 
@@ -122,8 +150,34 @@ def main() -> None:
     """
     Yes this is the main function. It creates an instance of the
     vaultify domain logic class, runs it. Very main()
+
+    With the batch action, it runs all jobs of a manifest instead.
     """
-    print(sys.argv)
-    vaultify = factory(CFG)
+    args = parse_args()
+
+    cfg_files = CFG_DEFAULT_FILES + ([args.config] if args.config else [])
+    cfg = CFG
+    if args.config or args.verbosity:
+        cfg = configure(cfg_files, verbosity=args.verbosity)
+        logging.config.dictConfig(dict(cfg, disable_existing_loggers=False))
+
+    profile_cfg = dict(cfg["vaultify"].get("profile") or {})
+    if args.profile:
+        profile_cfg.update(
+            dir=args.profile, modes=args.profile_modes, rate=args.profile_rate
+        )
+    profiler = Profiler.from_config(profile_cfg)
+
+    if args.action == "batch":
+        with profiler.section("batch"):
+            success = run_batch(args.manifest, workers=args.workers)
+        sys.exit(0 if success else 1)
+
+    if profiler.enabled:
+        with profiler.section("configure"):
+            cfg = configure(cfg_files, verbosity=args.verbosity)
+    with profiler.section("factory"):
+        vaultify = factory(cfg)
     vaultify.validate()
-    vaultify.run()
+    with profiler.section("run"):
+        vaultify.run()